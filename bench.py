@@ -0,0 +1,270 @@
+"""Offline broadcast benchmark.
+
+Runs the real send paths of bot.py (send_post_to_channels, send_all_posts_cb,
+send_all_multipost_cb) against a local fake Bot API server, so broadcast
+changes can be measured without network access or a real token.
+
+    python bench.py --channels 1000 --posts 50 --latency 0.05 --rate-429 0.01
+
+Rate limits default to "effectively off" so the numbers show our own
+overhead; pass --global-rate 30 --per-chat-rate 1 to see real-world pacing.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+BENCH_TOKEN = "123456:BENCH"
+ADMIN_CHAT_ID = 777
+
+# -----------------------
+# Fake Bot API server
+# -----------------------
+class FakeApiState:
+    def __init__(self, latency: float, rate_429: float, error_rate: float, retry_after: int):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.next_message_id = 1
+        self.calls = {}
+
+    def message_ids(self, n: int) -> list:
+        with self.lock:
+            first = self.next_message_id
+            self.next_message_id += n
+        return list(range(first, first + n))
+
+    def count(self, method: str):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+def make_handler(state: FakeApiState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            method = self.path.rsplit("/", 1)[-1]
+            state.count(method)
+            if method == "getMe":
+                return self.reply(200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}})
+            if state.latency:
+                time.sleep(state.latency)
+            roll = random.random()
+            if roll < state.rate_429:
+                return self.reply(429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {state.retry_after}",
+                    "parameters": {"retry_after": state.retry_after},
+                })
+            if roll < state.rate_429 + state.error_rate:
+                return self.reply(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"})
+            return self.reply(200, {"ok": True, "result": self.result_for(method)})
+
+        do_GET = do_POST
+
+        def result_for(self, method: str):
+            now = int(time.time())
+            chat = {"id": -1000, "type": "channel", "title": "bench"}
+            if method == "sendMediaGroup":
+                # মিডিয়া গ্রুপের আকার জানা নেই, তাই ১০টা আইডি ফেরত দেয় (zip এ বাড়তিগুলো বাদ পড়ে)
+                return [{"message_id": i, "date": now, "chat": chat} for i in state.message_ids(10)]
+            if method == "copyMessages":
+                return [{"message_id": i} for i in state.message_ids(100)]
+            if method == "copyMessage":
+                return {"message_id": state.message_ids(1)[0]}
+            return {"message_id": state.message_ids(1)[0], "date": now, "chat": chat, "text": "ok"}
+
+    return Handler
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # ক্লায়েন্ট বন্ধ হয়ে গেলে (শেষে shutdown) কানেকশন এরর স্বাভাবিক
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_fake_api(state: FakeApiState):
+    server = FakeApiServer(("127.0.0.1", 0), make_handler(state))
+    threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+    return server
+
+# -----------------------
+# Client side timing
+# -----------------------
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that records the wall time of every Bot API call."""
+
+    def __init__(self, samples: list, **kwargs):
+        super().__init__(**kwargs)
+        self.samples = samples
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# -----------------------
+# Scenarios
+# -----------------------
+def make_posts(n: int, media: bool) -> list:
+    posts = []
+    for i in range(1, n + 1):
+        if media:
+            posts.append({'id': i, 'text': f"Bench photo {i}", 'media_type': "photo", 'media_id': f"BENCHFILE{i}"})
+        else:
+            posts.append({'id': i, 'text': f"Bench post {i}"})
+    return posts
+
+def fake_callback(data: str, user_data: dict):
+    async def noop(*args, **kwargs):
+        return None
+    message = SimpleNamespace(chat_id=ADMIN_CHAT_ID, reply_text=noop)
+    query = SimpleNamespace(data=data, message=message, answer=noop)
+    return SimpleNamespace(callback_query=query), SimpleNamespace(user_data=user_data)
+
+async def wait_for_jobs(bot_module):
+    while any(j.status in ("queued", "running") for j in bot_module.broadcast_jobs.jobs.values()):
+        await asyncio.sleep(0.02)
+
+def job_totals(bot_module) -> int:
+    return sum(j.sent for j in bot_module.broadcast_jobs.jobs.values())
+
+async def scenario_send_post_to_channels(bot_module, app, posts):
+    sent = 0
+    for post in posts:
+        sent += bot_module.count_sent(await bot_module.send_post_to_channels(app, post))
+    return sent
+
+async def scenario_send_all_posts(bot_module, app, posts):
+    before = job_totals(bot_module)
+    update, context = fake_callback("send_all_posts", {})
+    await bot_module.send_all_posts_cb(update, context)
+    await wait_for_jobs(bot_module)
+    return job_totals(bot_module) - before
+
+async def scenario_send_all_multipost(bot_module, app, posts):
+    before = job_totals(bot_module)
+    update, context = fake_callback("send_all_multipost", {'multipost_list': [p['id'] for p in posts]})
+    await bot_module.send_all_multipost_cb(update, context)
+    await wait_for_jobs(bot_module)
+    return job_totals(bot_module) - before
+
+SCENARIOS = {
+    "send_post_to_channels": (scenario_send_post_to_channels, False),
+    "send_all_posts": (scenario_send_all_posts, False),
+    "send_all_multipost": (scenario_send_all_multipost, True),
+}
+
+async def run(args):
+    import bot as bot_module
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.ERROR)
+
+    state = FakeApiState(args.latency, args.rate_429, args.error_rate, args.retry_after)
+    server = start_fake_api(state)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    samples = []
+    pool = max(args.concurrency, 8) + 8
+    bot = Bot(
+        BENCH_TOKEN,
+        base_url=f"{base}/bot",
+        base_file_url=f"{base}/file/bot",
+        request=TimedRequest(samples, connection_pool_size=pool, read_timeout=30, pool_timeout=30),
+    )
+    await bot.initialize()
+    app = SimpleNamespace(bot=bot)
+
+    bot_module.BROADCAST_CONCURRENCY = args.concurrency
+    bot_module.rate_limiter = bot_module.RateLimiter(args.global_rate, args.per_chat_rate)
+    if args.staging:
+        bot_module.STAGING_CHAT_ID = -424242
+    bot_module.broadcast_jobs.start(app)
+
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    print(f"{args.channels} channels x {args.posts} posts, latency {args.latency * 1000:.0f}ms, "
+          f"429 {args.rate_429:.1%}, errors {args.error_rate:.1%}, concurrency {args.concurrency}")
+    print(f"{'scenario':<24}{'sent':>9}{'calls':>9}{'wall s':>9}{'msg/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for name in names:
+        func, media = SCENARIOS[name]
+        posts = make_posts(args.posts, media)
+        bot_module.posts_repo.replace_all(posts)
+        bot_module.channels_repo.replace_all([{'id': -1001000000000 - i, 'title': f"Bench {i}"} for i in range(args.channels)])
+        samples.clear()
+        state.calls.clear()
+        started = time.perf_counter()
+        sent = await func(bot_module, app, posts)
+        wall = time.perf_counter() - started
+        calls = sum(n for m, n in state.calls.items() if m != "getMe")
+        print(f"{name:<24}{sent:>9}{calls:>9}{wall:>9.2f}{sent / wall if wall else 0:>10.1f}"
+              f"{percentile(samples, 50) * 1000:>9.1f}{percentile(samples, 99) * 1000:>9.1f}")
+
+    await bot_module.broadcast_jobs.stop()
+    await bot.shutdown()
+    server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["all"] + list(SCENARIOS), default="all")
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake server latency per call, seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with injected 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 502")
+    parser.add_argument("--concurrency", type=int, default=20, help="BROADCAST_CONCURRENCY for the run")
+    parser.add_argument("--global-rate", type=float, default=100000)
+    parser.add_argument("--per-chat-rate", type=float, default=100000)
+    parser.add_argument("--staging", action="store_true", help="replicate multiposts through a staging chat")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's retry/failure logs")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # বেঞ্চমার্ক কখনো আসল ডাটা ফাইলে হাত দেবে না
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("STORAGE_BACKEND", "json")
+    # ওয়েবহুক মোডের env থাকলেও বেঞ্চমার্ক আসল টোকেনে set_webhook করবে না
+    os.environ["WEBHOOK_URL"] = ""
+    os.environ["SESSION_FILE"] = os.path.join(workdir, "sessions.db")
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(workdir)
+    sys.path.insert(0, here)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,42 @@
 import os
 import json
+import re
 import logging
 import threading
+import atexit
+import sqlite3
+import shutil
+import struct
+import zlib
+import hashlib
+import hmac
+import secrets
+import weakref
+from collections import OrderedDict
+import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+import heapq
+import bisect
+import pytz
+from flask import Flask, Response, abort, request
 import asyncio
+import random
+from enum import Enum
 from telegram import (
-    Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+    Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup,
+    InputMediaPhoto, InputMediaVideo
 )
 from telegram.constants import ParseMode
+from telegram.error import (
+    BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TimedOut
+)
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    CallbackQueryHandler, ContextTypes
+    CallbackQueryHandler, ContextTypes, BasePersistence, PersistenceInput,
+    BaseUpdateProcessor
 )
+from telegram.request import HTTPXRequest
 
 # -----------------------
 # Logging
@@ -22,10 +46,211 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 # -----------------------
 # Config / Files
 # -----------------------
-TOKEN = "8061585389:AAFT-3cubiYTU9VjX9VVYDE8Q6hh6mJJc-s"  # এখানে তোমার বট টোকেন দিয়ে দেবে
+TOKEN = os.environ.get("BOT_TOKEN") or "8061585389:AAFT-3cubiYTU9VjX9VVYDE8Q6hh6mJJc-s"  # এখানে তোমার বট টোকেন দিয়ে দেবে
 CHANNEL_FILE = "channels.json"
 POST_FILE = "posts.json"
 MULTIPOST_FILE = "multiposts.json"
+SCHEDULE_FILE = "scheduled_posts.json"
+# Delivery ledger: where each post landed (channel, message id), for edits
+LEDGER_FILE = "deliveries.json"
+LEDGER_MAX_COPIES = int(os.environ.get("LEDGER_MAX_COPIES", "20"))
+# Copies older than this can no longer be edited or retracted from the bot;
+# pruning keeps deliveries.json (fully rewritten on the JSON backend) small
+LEDGER_TTL = float(os.environ.get("LEDGER_TTL", str(30 * 24 * 3600)))
+
+# Storage: "json" (default, the files above), "sqlite" (SQLITE_FILE, WAL mode)
+# or "journal" (append-only log + compacted snapshot next to each JSON file)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json").lower()
+SQLITE_FILE = os.environ.get("SQLITE_FILE", "bot.db")
+JOURNAL_COMPACT_BYTES = int(os.environ.get("JOURNAL_COMPACT_BYTES", str(1024 * 1024)))
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", "2"))
+# Deleted posts leave a tombstone; old ones are compacted away in the background
+TOMBSTONE_TTL = float(os.environ.get("TOMBSTONE_TTL", str(7 * 24 * 3600)))
+COMPACT_INTERVAL = float(os.environ.get("COMPACT_INTERVAL", "3600"))
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", "10"))
+
+# Conversation state (context.user_data) survives restarts; changed keys are
+# written every SESSION_FLUSH_INTERVAL seconds
+SESSION_FILE = os.environ.get("SESSION_FILE", "sessions.db")
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", "10"))
+
+# Polling worker only: serve /metrics on this port (the web service always has it)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Update processing: different admins are served in parallel, one admin's
+# updates stay in order. Separate HTTP pools for getUpdates and API calls.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "16"))
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", "64"))
+UPDATES_POOL_SIZE = int(os.environ.get("UPDATES_POOL_SIZE", "2"))
+POOL_TIMEOUT = float(os.environ.get("POOL_TIMEOUT", "10"))
+
+# Webhook mode: set WEBHOOK_URL (public https base URL) on the web service
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+# Default secret is random per process (set_webhook sends it on every start);
+# never derive it from the token
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_hex(32)
+WEBHOOK_DEDUP_SIZE = int(os.environ.get("WEBHOOK_DEDUP_SIZE", "10000"))
+
+# Scheduling
+SCHEDULE_TZ = os.environ.get("SCHEDULE_TZ", "Asia/Dhaka")
+SCHEDULE_CATCHUP_SECONDS = float(os.environ.get("SCHEDULE_CATCHUP_SECONDS", str(24 * 3600)))
+
+# Broadcast tuning: Telegram allows ~30 msg/s per bot overall and ~1 msg/s per chat
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+GLOBAL_RATE_PER_SEC = float(os.environ.get("GLOBAL_RATE_PER_SEC", "30"))
+PER_CHAT_RATE_PER_SEC = float(os.environ.get("PER_CHAT_RATE_PER_SEC", "1"))
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "2"))
+# Optional extra bot tokens (comma separated), each admin in the channels;
+# text posts are spread over all tokens, media stays on the main bot
+BOT_POOL_TOKENS = [t.strip() for t in os.environ.get("BOT_POOL_TOKENS", "").split(",") if t.strip()]
+POOL_VNODES = 64
+
+# Multipost: send consecutive photo/video posts without buttons as one album
+MULTIPOST_ALBUMS = os.environ.get("MULTIPOST_ALBUMS", "1") == "1"
+# Multipost: post once to a private staging chat, then copy_messages to channels
+STAGING_CHAT_ID = int(os.environ["STAGING_CHAT_ID"]) if os.environ.get("STAGING_CHAT_ID") else None
+COPY_BATCH_SIZE = 100
+
+# Delivery policy: retries for transient errors, breaker for dead channels
+MAX_SEND_ATTEMPTS = int(os.environ.get("MAX_SEND_ATTEMPTS", "4"))
+BACKOFF_BASE = float(os.environ.get("BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.environ.get("BACKOFF_MAX", "30"))
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", str(6 * 3600)))
+
+# Channel health: get_chat/get_chat_member for every channel at startup and
+# every HEALTH_INTERVAL seconds; a result is trusted for HEALTH_TTL seconds
+HEALTH_INTERVAL = float(os.environ.get("HEALTH_INTERVAL", "1800"))
+HEALTH_TTL = float(os.environ.get("HEALTH_TTL", "3600"))
+HEALTH_CONCURRENCY = int(os.environ.get("HEALTH_CONCURRENCY", "10"))
+HEALTH_RATE_PER_SEC = float(os.environ.get("HEALTH_RATE_PER_SEC", "20"))
+
+# -----------------------
+# Metrics (Prometheus text format, served at /metrics)
+# -----------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _label_str(labels: tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_label_str(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}   # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            rows = [(key, list(row)) for key, row in self.values.items()]
+        for key, row in rows:
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {row[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {row[-2]}")
+            lines.append(f"{self.name}_count{_label_str(key)} {row[-1]}")
+        return lines
+
+class Gauge:
+    """Read at scrape time from a callback, so it never goes stale."""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self) -> list:
+        try:
+            value = self.read()
+        except Exception:
+            logging.exception("Gauge %s failed", self.name)
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+METRICS = []
+
+def register_metric(metric):
+    METRICS.append(metric)
+    return metric
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+HANDLER_SECONDS = register_metric(Histogram("bot_handler_seconds", "Update handler latency by registered pattern."))
+HANDLER_ERRORS = register_metric(Counter("bot_handler_errors_total", "Handler exceptions by registered pattern."))
+SEND_SECONDS = register_metric(Histogram("bot_send_seconds", "Bot API send latency per target chat (one attempt)."))
+SEND_ERRORS = register_metric(Counter("bot_send_errors_total", "Failed send attempts per target chat and error type."))
+STORAGE_SECONDS = register_metric(Histogram("bot_storage_seconds", "Storage read/write time per file or table."))
+
+def instrument_handlers(application):
+    """Wrap every registered handler callback with latency/error metrics."""
+    for group in application.handlers.values():
+        for handler in group:
+            if getattr(handler, "pattern", None) is not None:
+                label = getattr(handler.pattern, "pattern", str(handler.pattern))
+            elif getattr(handler, "commands", None):
+                label = "/" + ",".join(sorted(handler.commands))
+            else:
+                label = handler.callback.__name__
+            handler.callback = timed_callback(handler.callback, label)
+
+def timed_callback(callback, label: str):
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=label, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=label)
+    wrapper.__name__ = callback.__name__
+    return wrapper
 
 # -----------------------
 # Helpers: JSON file IO
@@ -33,15 +258,610 @@ MULTIPOST_FILE = "multiposts.json"
 def load_json(filename):
     if not os.path.exists(filename):
         return []
+    started = time.perf_counter()
+    try:
+        return _read_json(filename)
+    finally:
+        STORAGE_SECONDS.observe(time.perf_counter() - started, op="read", target=filename)
+
+def _read_json(filename):
     with open(filename, "r", encoding="utf-8") as f:
         try:
             return json.load(f)
         except Exception:
+            # নষ্ট ফাইল সরিয়ে রাখবে, যাতে পরের save এ ডাটা চিরতরে মুছে না যায়
+            logging.error("Could not parse %s, keeping a copy as %s.corrupt", filename, filename)
+            shutil.copyfile(filename, filename + ".corrupt")
             return []
 
+def write_atomic(filename, payload: bytes):
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
 def save_json(filename, data):
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    started = time.perf_counter()
+    write_atomic(filename, json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"))
+    STORAGE_SECONDS.observe(time.perf_counter() - started, op="write", target=filename)
+
+# -----------------------
+# Storage backends
+# -----------------------
+class JsonFileBackend:
+    """Whole-file JSON storage (the original posts.json/channels.json format)."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def wants_full_write(self) -> bool:
+        return True
+
+    def load(self) -> list:
+        return load_json(self.filename)
+
+    def write(self, items, changed, deleted):
+        save_json(self.filename, items)
+
+class SqliteStore:
+    """One shared SQLite database (WAL mode) for all tables plus delivery history."""
+
+    TABLES = ("posts", "channels", "scheduled_posts", "ledger")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for table in self.TABLES:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " post_id INTEGER NOT NULL,"
+                " channel_id INTEGER NOT NULL,"
+                " message_id INTEGER,"
+                " ok INTEGER NOT NULL,"
+                " error TEXT,"
+                " sent_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS deliveries_post_channel ON deliveries (post_id, channel_id)")
+
+    def load_table(self, table: str) -> list:
+        with self.lock:
+            rows = self.conn.execute(f"SELECT data FROM {table} ORDER BY id").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def count_rows(self, table: str) -> int:
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def get_row(self, table: str, item_id):
+        with self.lock:
+            row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (item_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_table(self, table: str, items, changed, deleted):
+        with self.lock, self.conn:
+            if items is not None:
+                self.conn.execute(f"DELETE FROM {table}")
+                changed = items
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)",
+                [(x['id'], json.dumps(x, ensure_ascii=False)) for x in changed]
+            )
+            if deleted:
+                self.conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(i,) for i in deleted])
+
+    def record_deliveries(self, post_id, results: dict):
+        now = time.time()
+        rows = [(post_id, ch_id, r.get('message_id'), 1 if r.get('ok') else 0, r.get('error'), now)
+                for ch_id, r in results.items()]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO deliveries (post_id, channel_id, message_id, ok, error, sent_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+class SqliteTableBackend:
+    """Row-level storage: only changed records are written on flush."""
+
+    def __init__(self, store: SqliteStore, table: str):
+        self.store = store
+        self.table = table
+        self.filename = f"{store.path}:{table}"
+
+    def wants_full_write(self) -> bool:
+        return False
+
+    def load(self) -> list:
+        return self.store.load_table(self.table)
+
+    def write(self, items, changed, deleted):
+        self.store.write_table(self.table, items, changed, deleted)
+
+class JournalBackend:
+    """Append-only operation log plus a periodically compacted snapshot.
+
+    Both files hold length-prefixed records: 4-byte length, 4-byte CRC32, then
+    compact JSON. A flush appends one record per changed/deleted id and fsyncs
+    once; when the log grows past JOURNAL_COMPACT_BYTES the next flush writes a
+    fresh snapshot atomically and truncates the log. Loading replays the
+    snapshot and then the log, stopping at the first torn record.
+
+    The snapshot starts with a {'generation': n} record and every log record
+    carries the generation it was written against. A new snapshot bumps the
+    generation, so a log left behind by a crash between the snapshot swap
+    and the truncate is ignored instead of replayed over newer data.
+    """
+
+    HEADER = struct.Struct(">II")
+
+    def __init__(self, filename: str):
+        base = os.path.splitext(filename)[0]
+        self.filename = filename
+        self.snapshot_file = base + ".snapshot"
+        self.journal_file = base + ".journal"
+        self.needs_snapshot = False
+        self.generation = 0
+
+    def wants_full_write(self) -> bool:
+        if self.needs_snapshot:
+            return True
+        try:
+            return os.path.getsize(self.journal_file) > JOURNAL_COMPACT_BYTES
+        except OSError:
+            return False
+
+    @classmethod
+    def encode(cls, record) -> bytes:
+        body = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return cls.HEADER.pack(len(body), zlib.crc32(body)) + body
+
+    @classmethod
+    def read_records(cls, path: str):
+        """Return (records, end offset of the last intact record)."""
+        if not os.path.exists(path):
+            return [], 0
+        with open(path, "rb") as f:
+            data = f.read()
+        records = []
+        pos = 0
+        while pos < len(data):
+            if pos + cls.HEADER.size > len(data):
+                break
+            length, crc = cls.HEADER.unpack_from(data, pos)
+            body = data[pos + cls.HEADER.size:pos + cls.HEADER.size + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                break
+            records.append(json.loads(body))
+            pos += cls.HEADER.size + length
+        if pos < len(data):
+            logging.warning("Ignoring torn record at byte %s of %s", pos, path)
+        return records, pos
+
+    def load(self) -> list:
+        if not os.path.exists(self.snapshot_file) and not os.path.exists(self.journal_file):
+            # প্রথমবার: পুরনো JSON ফাইল থেকে শুরু করবে
+            self.needs_snapshot = True
+            return load_json(self.filename)
+        snapshot, _ = self.read_records(self.snapshot_file)
+        # পুরনো স্ন্যাপশটে হেডার নেই, সেটা জেনারেশন ০
+        self.generation = snapshot.pop(0)['generation'] if snapshot and 'id' not in snapshot[0] else 0
+        items = {x['id']: x for x in snapshot}
+        ops, valid_end = self.read_records(self.journal_file)
+        stale = [op for op in ops if op.get('gen', 0) != self.generation]
+        if stale:
+            logging.warning("Ignoring %s journal records from an older snapshot in %s", len(stale), self.journal_file)
+            ops = [op for op in ops if op.get('gen', 0) == self.generation]
+            # বাতিল রেকর্ডগুলো কেটে দেয়; বাকিগুলো পরের স্ন্যাপশটে যাবে
+            self.needs_snapshot = True
+        if os.path.exists(self.journal_file) and os.path.getsize(self.journal_file) > valid_end:
+            # ক্র্যাশে অর্ধেক লেখা রেকর্ড কেটে ফেলবে, নাহলে নতুন রেকর্ড তার পেছনে হারিয়ে যাবে
+            with open(self.journal_file, "r+b") as f:
+                f.truncate(valid_end)
+                os.fsync(f.fileno())
+        for op in ops:
+            if op.get('op') == 'put':
+                items[op['item']['id']] = op['item']
+            elif op.get('op') == 'del':
+                items.pop(op['id'], None)
+        return list(items.values())
+
+    def write(self, items, changed, deleted):
+        if items is not None:
+            generation = self.generation + 1
+            header = self.encode({'generation': generation})
+            write_atomic(self.snapshot_file, header + b"".join(self.encode(x) for x in items))
+            # এখানে ক্র্যাশ হলেও পুরনো লগের gen মিলবে না, তাই আর রিপ্লে হবে না
+            self.generation = generation
+            with open(self.journal_file, "wb") as f:
+                os.fsync(f.fileno())
+            self.needs_snapshot = False
+            return
+        gen = self.generation
+        ops = [{'op': 'put', 'gen': gen, 'item': x} for x in changed] + [{'op': 'del', 'gen': gen, 'id': i} for i in deleted]
+        with open(self.journal_file, "ab") as f:
+            f.write(b"".join(self.encode(op) for op in ops))
+            f.flush()
+            os.fsync(f.fileno())
+
+_sqlite_store = None
+
+def get_sqlite_store() -> SqliteStore:
+    global _sqlite_store
+    if _sqlite_store is None:
+        _sqlite_store = SqliteStore(SQLITE_FILE)
+    return _sqlite_store
+
+def make_backend(filename: str, table: str):
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteTableBackend(get_sqlite_store(), table)
+    if STORAGE_BACKEND == "journal":
+        return JournalBackend(filename)
+    return JsonFileBackend(filename)
+
+def record_deliveries(post_id, results: dict):
+    """Note successful sends in the delivery ledger (every backend) and keep
+    the full history when the SQLite backend is active."""
+    ledger_record(post_id, results)
+    if STORAGE_BACKEND != "sqlite":
+        return
+    try:
+        get_sqlite_store().record_deliveries(post_id, results)
+    except Exception:
+        logging.exception("Could not record deliveries for post %s", post_id)
+
+def migrate_json_to_sqlite(db_path: str = None, force: bool = False):
+    """One-shot import of the JSON files into SQLite.
+
+    Refuses (RuntimeError) when any target table already has rows, since the
+    import replaces the tables with the JSON contents; force=True overwrites.
+    """
+    store = SqliteStore(db_path or SQLITE_FILE)
+    sources = ((POST_FILE, "posts"), (CHANNEL_FILE, "channels"), (SCHEDULE_FILE, "scheduled_posts"), (LEDGER_FILE, "ledger"))
+    if not force:
+        used = [table for _, table in sources if store.count_rows(table)]
+        if used:
+            raise RuntimeError(f"{store.path} already has data in {', '.join(used)}; use --force to overwrite it with the JSON files")
+    counts = {}
+    for filename, table in sources:
+        items = [x for x in load_json(filename) if isinstance(x, dict) and 'id' in x]
+        store.write_table(table, items, None, None)
+        counts[table] = len(items)
+    return counts
+
+# -----------------------
+# In-memory repository (write-back persistence)
+# -----------------------
+class VersionConflict(Exception):
+    """A record changed after the caller read it (optimistic check failed)."""
+
+    def __init__(self, item_id, expected, actual):
+        super().__init__(f"record {item_id} is at version {actual}, expected {expected}")
+        self.item_id = item_id
+        self.expected = expected
+        self.actual = actual
+
+class Transaction:
+    """`async with repo.transaction(id) as draft:` — edit a copy of one record
+    while holding that record's asyncio lock; on a clean exit the changed
+    fields are written with a version check, on an exception nothing is."""
+
+    def __init__(self, repo, item_id, expected_version=None):
+        self.repo = repo
+        self.item_id = item_id
+        self.expected_version = expected_version
+        self.lock = repo.async_lock(item_id)
+        self.base = None
+        self.draft = None
+
+    async def __aenter__(self) -> dict:
+        await self.lock.acquire()
+        current = self.repo.get(self.item_id)
+        if current is None:
+            self.lock.release()
+            raise KeyError(self.item_id)
+        version = current.get('version', 0)
+        if self.expected_version is not None and version != self.expected_version:
+            self.lock.release()
+            raise VersionConflict(self.item_id, self.expected_version, version)
+        self.base = dict(current)
+        self.draft = dict(current)
+        return self.draft
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                changes = {k: v for k, v in self.draft.items()
+                           if k not in ('id', 'version') and self.base.get(k) != v}
+                if changes:
+                    self.repo.update(self.item_id, expected_version=self.base.get('version', 0), **changes)
+        finally:
+            self.lock.release()
+        return False
+
+class Repository:
+    """Process-wide in-memory copy of one collection (posts, channels, ...).
+
+    Reads are served from memory; writes only mark the repository dirty and the
+    background flusher persists it at most once per FLUSH_INTERVAL. Incremental
+    backends (SQLite, journal) receive just the changed and deleted ids.
+    Callers must mutate records through add/update/remove, never in place.
+
+    Ids from create() are monotonic and never reused. tombstone() deletes a
+    record softly: a small {'id', 'deleted': True} record stays on disk so the
+    id can't come back, and compact() later drops old tombstones except the
+    one holding the highest id.
+
+    Every record carries a `version` that update() bumps; pass
+    expected_version to make the write fail with VersionConflict if someone
+    else got there first. transaction() adds a per-record asyncio lock for
+    read-modify-write sequences that await in between.
+    """
+
+    def __init__(self, filename: str, backend=None):
+        self.filename = filename
+        self.backend = backend or JsonFileBackend(filename)
+        self.lock = threading.RLock()
+        self.by_id = {}
+        self.tombstones = {}
+        self.next_id = 1
+        self.changed_ids = set()
+        self.deleted_ids = set()
+        self.full_rewrite = False
+        self.dirty = False
+        self.loaded = False
+        self.listeners = []
+        self.async_locks = weakref.WeakValueDictionary()
+
+    def _notify(self, op: str, item=None):
+        for listener in self.listeners:
+            listener(op, item)
+
+    @staticmethod
+    def _max_id(records) -> int:
+        return max((x['id'] for x in records if type(x.get('id')) is int), default=0)
+
+    def load(self):
+        with self.lock:
+            started = time.perf_counter()
+            records = self.backend.load()
+            STORAGE_SECONDS.observe(time.perf_counter() - started, op="load", target=self.backend.filename)
+            self.by_id = {x['id']: x for x in records if not x.get('deleted')}
+            self.tombstones = {x['id']: x for x in records if x.get('deleted')}
+            self.next_id = max(1, self._max_id(records) + 1)
+            self.changed_ids.clear()
+            self.deleted_ids.clear()
+            self.full_rewrite = False
+            self.dirty = False
+            self.loaded = True
+            self._notify('reset')
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _touch(self, item_id):
+        self.changed_ids.add(item_id)
+        self.deleted_ids.discard(item_id)
+        self.dirty = True
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.by_id)
+
+    def all(self) -> list:
+        self._ensure_loaded()
+        return list(self.by_id.values())
+
+    def get(self, item_id):
+        self._ensure_loaded()
+        return self.by_id.get(item_id)
+
+    def is_deleted(self, item_id) -> bool:
+        self._ensure_loaded()
+        return item_id in self.tombstones
+
+    def add(self, item: dict) -> dict:
+        self._ensure_loaded()
+        with self.lock:
+            item_id = item['id']
+            item.setdefault('version', 1)
+            self.by_id[item_id] = item
+            self.tombstones.pop(item_id, None)
+            if type(item_id) is int and item_id >= self.next_id:
+                self.next_id = item_id + 1
+            self._touch(item_id)
+            self._notify('put', item)
+        return item
+
+    def create(self, item: dict) -> int:
+        """Assign the next id to `item`, store it and return the id."""
+        self._ensure_loaded()
+        with self.lock:
+            new_id = self.next_id
+            self.next_id += 1
+            self.add({'id': new_id, **item})
+        return new_id
+
+    def update(self, item_id, expected_version=None, **fields):
+        self._ensure_loaded()
+        with self.lock:
+            item = self.by_id.get(item_id)
+            if item is None:
+                return None
+            version = item.get('version', 0)
+            if expected_version is not None and version != expected_version:
+                raise VersionConflict(item_id, expected_version, version)
+            item.update(fields)
+            item['version'] = version + 1
+            self._touch(item_id)
+            self._notify('put', item)
+        return item
+
+    def version_of(self, item_id):
+        item = self.get(item_id)
+        return None if item is None else item.get('version', 0)
+
+    def async_lock(self, item_id) -> asyncio.Lock:
+        lock = self.async_locks.get(item_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.async_locks[item_id] = lock
+        return lock
+
+    def transaction(self, item_id, expected_version=None) -> Transaction:
+        return Transaction(self, item_id, expected_version)
+
+    def remove(self, item_id):
+        """Hard delete; the id may be added again later (channels)."""
+        self._ensure_loaded()
+        with self.lock:
+            item = self.by_id.pop(item_id, None)
+            if item is not None:
+                self.changed_ids.discard(item_id)
+                self.deleted_ids.add(item_id)
+                self.dirty = True
+                self._notify('del', item)
+        return item
+
+    def tombstone(self, item_id):
+        """Soft delete in O(1): the record is replaced by a tombstone."""
+        self._ensure_loaded()
+        with self.lock:
+            item = self.by_id.pop(item_id, None)
+            if item is not None:
+                self.tombstones[item_id] = {'id': item_id, 'deleted': True, 'deleted_at': time.time()}
+                self._touch(item_id)
+                self._notify('del', item)
+        return item
+
+    def compact(self, max_age: float) -> int:
+        """Forget tombstones older than `max_age` seconds. The tombstone with
+        the highest id is kept while no live record is above it, so next_id
+        survives a restart."""
+        self._ensure_loaded()
+        with self.lock:
+            now = time.time()
+            high_water = self.next_id - 1
+            expired = [i for i, t in self.tombstones.items()
+                       if now - t.get('deleted_at', 0) >= max_age and i != high_water]
+            for item_id in expired:
+                del self.tombstones[item_id]
+                self.changed_ids.discard(item_id)
+                self.deleted_ids.add(item_id)
+            if expired:
+                self.dirty = True
+        return len(expired)
+
+    def replace_all(self, items: list):
+        with self.lock:
+            self.by_id = {x['id']: x for x in items}
+            for item_id in self.by_id:
+                self.tombstones.pop(item_id, None)
+            self.next_id = max(self.next_id, self._max_id(items) + 1)
+            self.full_rewrite = True
+            self.dirty = True
+            self.loaded = True
+            self._notify('reset')
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            if not self.full_rewrite and not self.backend.wants_full_write():
+                items = None
+                changed = [dict(self.by_id.get(i) or self.tombstones[i]) for i in self.changed_ids
+                           if i in self.by_id or i in self.tombstones]
+            else:
+                items = [dict(x) for x in self.by_id.values()] + [dict(t) for t in self.tombstones.values()]
+                changed = []
+            deleted = list(self.deleted_ids)
+            self.changed_ids.clear()
+            self.deleted_ids.clear()
+            self.full_rewrite = False
+            self.dirty = False
+        started = time.perf_counter()
+        try:
+            self.backend.write(items, changed, deleted)
+            STORAGE_SECONDS.observe(time.perf_counter() - started, op="flush", target=self.backend.filename)
+        except Exception:
+            with self.lock:
+                # পরের বার পুরোটা লিখে দেবে, যাতে কোনো পরিবর্তন হারিয়ে না যায়
+                self.full_rewrite = True
+                self.dirty = True
+            raise
+
+class WriteBackFlusher(threading.Thread):
+    """Daemon thread that periodically flushes dirty repositories and, every
+    COMPACT_INTERVAL, drops tombstones older than TOMBSTONE_TTL."""
+
+    def __init__(self, repos: list, interval: float):
+        super().__init__(name="repo-flusher", daemon=True)
+        self.repos = repos
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.last_compact = time.time()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if time.time() - self.last_compact >= COMPACT_INTERVAL:
+                self.compact_all()
+            self.flush_all()
+
+    def compact_all(self):
+        self.last_compact = time.time()
+        for repo in self.repos:
+            try:
+                dropped = repo.compact(TOMBSTONE_TTL)
+                if dropped:
+                    logging.info("Compacted %s tombstones from %s", dropped, repo.filename)
+            except Exception:
+                logging.exception("Compaction failed for %s", repo.filename)
+        try:
+            pruned = ledger_prune(LEDGER_TTL)
+            if pruned:
+                logging.info("Pruned %s old copies from the delivery ledger", pruned)
+        except Exception:
+            logging.exception("Ledger pruning failed")
+
+    def flush_all(self):
+        for repo in self.repos:
+            try:
+                repo.flush()
+            except Exception:
+                logging.exception("Flush failed for %s", repo.filename)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.flush_all()
+
+posts_repo = Repository(POST_FILE, make_backend(POST_FILE, "posts"))
+channels_repo = Repository(CHANNEL_FILE, make_backend(CHANNEL_FILE, "channels"))
+schedules_repo = Repository(SCHEDULE_FILE, make_backend(SCHEDULE_FILE, "scheduled_posts"))
+ledger_repo = Repository(LEDGER_FILE, make_backend(LEDGER_FILE, "ledger"))
+REPOSITORIES = [posts_repo, channels_repo, schedules_repo, ledger_repo]
+_flusher = None
+
+def start_repositories():
+    global _flusher
+    for repo in REPOSITORIES:
+        repo.load()
+    if _flusher is None:
+        _flusher = WriteBackFlusher(REPOSITORIES, FLUSH_INTERVAL)
+        _flusher.start()
+        atexit.register(stop_repositories)
+
+def stop_repositories():
+    if _flusher is not None:
+        _flusher.stop()
 
 def ensure_files():
     if not os.path.exists(CHANNEL_FILE):
@@ -50,6 +870,225 @@ def ensure_files():
         save_json(POST_FILE, [])
     if not os.path.exists(MULTIPOST_FILE):
         save_json(MULTIPOST_FILE, [])
+    if not os.path.exists(SCHEDULE_FILE):
+        save_json(SCHEDULE_FILE, [])
+    if not os.path.exists(LEDGER_FILE):
+        save_json(LEDGER_FILE, [])
+
+# -----------------------
+# Delivery ledger
+# -----------------------
+# One record per post: {'id': post_id, 'copies': {"<channel_id>": [[message_id, bot_key, sent_at], ...]}}
+# Read-modify-write runs under ledger_repo.lock, the flusher thread prunes concurrently.
+def ledger_record(post_id, results: dict):
+    sent = {ch_id: r for ch_id, r in results.items() if r.get('ok') and r.get('message_id')}
+    if post_id is None or not sent:
+        return
+    now = time.time()
+    with ledger_repo.lock:
+        entry = ledger_repo.get(post_id)
+        # রেকর্ড জায়গায় বদলানো যাবে না (flusher কপি করে লেখে), তাই নতুন dict
+        copies = dict(entry['copies']) if entry else {}
+        for ch_id, r in sent.items():
+            key = str(ch_id)
+            copies[key] = (copies.get(key, []) + [[r['message_id'], r.get('bot', "main"), now]])[-LEDGER_MAX_COPIES:]
+        if entry:
+            ledger_repo.update(post_id, copies=copies)
+        else:
+            ledger_repo.add({'id': post_id, 'copies': copies})
+
+def _ledger_filter(post_id, keep) -> int:
+    """Keep only copies for which keep(channel_id, copy) is true; returns how many went."""
+    entry = ledger_repo.get(post_id)
+    if not entry:
+        return 0
+    copies, dropped = {}, 0
+    for ch_id, sent in entry['copies'].items():
+        kept = [c for c in sent if keep(int(ch_id), c)]
+        dropped += len(sent) - len(kept)
+        if kept:
+            copies[ch_id] = kept
+    if not dropped:
+        return 0
+    if copies:
+        ledger_repo.update(post_id, copies=copies)
+    else:
+        ledger_repo.remove(post_id)
+    return dropped
+
+def ledger_forget(post_ids, removed: set):
+    """Drop copies listed in `removed` ({(channel_id, message_id), ...}) from the ledger."""
+    with ledger_repo.lock:
+        for post_id in post_ids:
+            _ledger_filter(post_id, lambda ch_id, c: (ch_id, c[0]) not in removed)
+
+def ledger_prune(max_age: float) -> int:
+    """Forget copies sent more than `max_age` seconds ago."""
+    cutoff = time.time() - max_age
+    dropped = 0
+    with ledger_repo.lock:
+        for entry in ledger_repo.all():
+            dropped += _ledger_filter(entry['id'], lambda ch_id, c: len(c) > 2 and c[2] >= cutoff)
+    return dropped
+
+def ledger_copies(post_id) -> list:
+    """[(channel_id, message_id, bot_key), ...] for every recorded copy of a post."""
+    entry = ledger_repo.get(post_id)
+    if not entry:
+        return []
+    return [(int(ch_id), c[0], c[1]) for ch_id, sent in entry['copies'].items() for c in sent]
+
+# -----------------------
+# Session persistence (context.user_data)
+# -----------------------
+class SessionStore:
+    """SQLite table of (user_id, key) -> JSON value, one row per user_data key."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_data ("
+            "user_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, key))"
+        )
+        self.conn.commit()
+
+    def load_user(self, user_id: int) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT key, value FROM user_data WHERE user_id = ?", (user_id,)).fetchall()
+        data = {}
+        for key, value in rows:
+            try:
+                data[key] = json.loads(value)
+            except ValueError:
+                logging.warning("Dropping unreadable session key %s for user %s", key, user_id)
+        return data
+
+    def write_user(self, user_id: int, upserts: dict, deletes: list):
+        with self.lock, self.conn:
+            if upserts:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO user_data (user_id, key, value) VALUES (?, ?, ?)",
+                    [(user_id, k, v) for k, v in upserts.items()]
+                )
+            if deletes:
+                self.conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = ? AND key = ?",
+                    [(user_id, k) for k in deletes]
+                )
+
+    def drop_user(self, user_id: int):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class SessionPersistence(BasePersistence):
+    """Persists context.user_data only, key by key.
+
+    Nothing is read at startup: a user's session is loaded the first time an
+    update from them is processed (refresh_user_data). On every flush interval
+    only the keys whose JSON changed since the last write are stored.
+    """
+
+    def __init__(self, path: str, update_interval: float):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.store = None
+        self.loaded = set()
+        self.written = {}   # user_id -> {key: json} as last stored
+
+    def _store(self) -> SessionStore:
+        if self.store is None:
+            self.store = SessionStore(self.path)
+        return self.store
+
+    @staticmethod
+    def _encode(value):
+        try:
+            return json.dumps(value, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self.loaded:
+            return
+        stored = await asyncio.to_thread(self._store().load_user, user_id)
+        self.loaded.add(user_id)
+        self.written[user_id] = {k: self._encode(v) for k, v in stored.items()}
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        before = self.written.get(user_id, {})
+        after = {}
+        for key, value in data.items():
+            encoded = self._encode(value)
+            if encoded is None:
+                logging.warning("Session key %s for user %s is not JSON serialisable, skipped", key, user_id)
+                continue
+            after[key] = encoded
+        upserts = {k: v for k, v in after.items() if before.get(k) != v}
+        deletes = [k for k in before if k not in after]
+        if not upserts and not deletes:
+            return
+        await asyncio.to_thread(self._store().write_user, user_id, upserts, deletes)
+        self.written[user_id] = after
+
+    async def drop_user_data(self, user_id: int):
+        self.written.pop(user_id, None)
+        await asyncio.to_thread(self._store().drop_user, user_id)
+
+    async def flush(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    # user_data ছাড়া আর কিছু রাখা হয় না
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
 
 # -----------------------
 # Step stack helpers (for one-step back behavior)
@@ -72,14 +1111,117 @@ def peek_prev_step(context: ContextTypes.DEFAULT_TYPE):
 def clear_steps(context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop('step_stack', None)
 
+# -----------------------
+# Conversation state (what a text message means right now)
+# -----------------------
+class ConvState(str, Enum):
+    IDLE = "idle"
+    CREATING_POST = "creating_post"
+    POST_CAPTION = "post_caption"
+    POST_BUTTONS = "post_buttons"
+    EDITING_POST = "editing_post"
+    MULTIPOST = "multipost"
+    MULTIPOST_CAPTION = "multipost_caption"
+    MULTIPOST_BUTTONS = "multipost_buttons"
+
+MULTIPOST_STATES = frozenset({ConvState.MULTIPOST, ConvState.MULTIPOST_CAPTION, ConvState.MULTIPOST_BUTTONS})
+# মেনু থেকে যেকোনো অবস্থায় এগুলোতে যাওয়া যায়
+ENTRY_STATES = frozenset({ConvState.IDLE, ConvState.CREATING_POST, ConvState.EDITING_POST, ConvState.MULTIPOST})
+SINGLE_POST_STEPS = frozenset({ConvState.POST_CAPTION, ConvState.POST_BUTTONS})
+MULTIPOST_STEPS = frozenset({ConvState.MULTIPOST_CAPTION, ConvState.MULTIPOST_BUTTONS})
+
+# state -> states it may move to. Anything else (e.g. a stale "Add Caption"
+# button from a multipost pressed outside multipost mode) is refused.
+TRANSITIONS = {
+    ConvState.IDLE: ENTRY_STATES | SINGLE_POST_STEPS,
+    ConvState.CREATING_POST: ENTRY_STATES | SINGLE_POST_STEPS,
+    ConvState.POST_CAPTION: ENTRY_STATES | SINGLE_POST_STEPS,
+    ConvState.POST_BUTTONS: ENTRY_STATES | SINGLE_POST_STEPS,
+    ConvState.EDITING_POST: ENTRY_STATES | SINGLE_POST_STEPS,
+    ConvState.MULTIPOST: ENTRY_STATES | MULTIPOST_STEPS,
+    ConvState.MULTIPOST_CAPTION: ENTRY_STATES | MULTIPOST_STEPS,
+    ConvState.MULTIPOST_BUTTONS: ENTRY_STATES | MULTIPOST_STEPS,
+}
+
+# ডাটা যা শুধু চলতি ধাপের জন্য; IDLE এ ফিরলে মুছে যায়
+STATE_DATA_KEYS = ('pending_file_id', 'pending_type', 'buttons_post_id', 'editing_post', 'post_version')
+
+# step_stack এর ধাপ -> সেই ধাপে ফিরলে কোন state
+STEP_STATES = {
+    'creating_post': ConvState.CREATING_POST,
+    'awaiting_caption_choice': ConvState.CREATING_POST,
+    'awaiting_caption_text': ConvState.POST_CAPTION,
+    'awaiting_buttons_for_post_id': ConvState.POST_BUTTONS,
+    'editing_post': ConvState.EDITING_POST,
+    'creating_multipost': ConvState.MULTIPOST,
+    'awaiting_caption_choice_multipost': ConvState.MULTIPOST,
+    'awaiting_caption_text_multipost': ConvState.MULTIPOST_CAPTION,
+    'awaiting_buttons_for_multipost': ConvState.MULTIPOST_BUTTONS,
+}
+
+STALE_BUTTON_TEXT = "⌛ এই বাটনটি এখন আর কাজ করবে না। মেনু থেকে আবার শুরু করো।"
+
+POST_CHANGED_TEXT = "⚠️ এর মধ্যে অন্য কেউ পোস্টটি বদলেছে, তোমার পরিবর্তন সেভ হয়নি। পোস্টটি আবার খুলে চেষ্টা করো।"
+
+def get_state(context: ContextTypes.DEFAULT_TYPE) -> ConvState:
+    try:
+        return ConvState(context.user_data.get('state', ConvState.IDLE))
+    except ValueError:
+        return ConvState.IDLE
+
+def set_state(context: ContextTypes.DEFAULT_TYPE, state: ConvState, **data) -> bool:
+    current = get_state(context)
+    if state != current and state not in TRANSITIONS[current]:
+        logging.info("Refusing state change %s -> %s", current.value, state.value)
+        return False
+    context.user_data['state'] = state.value
+    if state == ConvState.IDLE:
+        for key in STATE_DATA_KEYS:
+            context.user_data.pop(key, None)
+    context.user_data.update(data)
+    return True
+
+def in_multipost(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    return get_state(context) in MULTIPOST_STATES
+
+def restore_step_state(context: ContextTypes.DEFAULT_TYPE, step: dict):
+    """Put the state (and its data) back to what `step` was waiting for."""
+    if not step:
+        set_state(context, ConvState.IDLE)
+        return
+    info = step.get('info', {})
+    data = {}
+    if info.get('file_id'):
+        data.update(pending_file_id=info['file_id'], pending_type=info.get('type'))
+    state = STEP_STATES.get(step.get('name'), ConvState.IDLE)
+    if state in (ConvState.POST_BUTTONS, ConvState.MULTIPOST_BUTTONS):
+        data['buttons_post_id'] = info.get('post_id')
+    elif state == ConvState.EDITING_POST:
+        data['editing_post'] = info.get('post_id')
+    context.user_data['state'] = state.value
+    context.user_data.update(data)
+
 # -----------------------
 # Button parser
 # -----------------------
-def parse_buttons_from_text(text):
-    if not text:
-        return None
+MARKUP_CACHE_SIZE = 512
+CALLBACK_DATA_LIMIT = 64  # bytes, Telegram limit
+_markup_cache = OrderedDict()
+
+def _clip_bytes(text: str, limit: int) -> str:
+    return text.encode("utf-8")[:limit].decode("utf-8", "ignore")
+
+def compile_buttons(text):
+    """Parse button lines into a JSON-friendly layout.
+
+    Returns (rows, errors): rows is a list of rows of {'text', 'url'|'callback_data'}
+    dicts, errors lists human-readable problems found while parsing.
+    """
     rows = []
-    for line in text.splitlines():
+    errors = []
+    if not text:
+        return rows, errors
+    for n, line in enumerate(text.splitlines(), 1):
         line = line.strip()
         if not line:
             continue
@@ -90,17 +1232,206 @@ def parse_buttons_from_text(text):
                 title, action = p.split(" - ", 1)
                 title = title.strip()[:64]
                 action = action.strip()
+                if not title:
+                    errors.append(f"Line {n}: button text is empty")
+                    continue
+                if not action:
+                    errors.append(f"Line {n}: '{title}' has no link or action")
+                    continue
                 if action.startswith(("http://", "https://", "tg://", "https://t.me")):
-                    row.append(InlineKeyboardButton(title, url=action))
-                elif action.startswith(("popup:", "alert:")):
-                    row.append(InlineKeyboardButton(title, callback_data=action))
+                    row.append({'text': title, 'url': action})
                 else:
-                    row.append(InlineKeyboardButton(title, callback_data=action[:64]))
-            else:
-                row.append(InlineKeyboardButton(p[:64], callback_data="noop"))
+                    if len(action.encode("utf-8")) > CALLBACK_DATA_LIMIT:
+                        errors.append(f"Line {n}: '{title}' action is longer than {CALLBACK_DATA_LIMIT} bytes and was cut")
+                        action = _clip_bytes(action, CALLBACK_DATA_LIMIT)
+                    row.append({'text': title, 'callback_data': action})
+            elif p:
+                row.append({'text': p[:64], 'callback_data': "noop"})
+        if len(row) > 8:
+            errors.append(f"Line {n}: Telegram allows at most 8 buttons per row")
+            row = row[:8]
         if row:
             rows.append(row)
-    return InlineKeyboardMarkup(rows) if rows else None
+    return rows, errors
+
+def buttons_hash(rows) -> str:
+    return hashlib.sha1(json.dumps(rows, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+def button_fields(text):
+    """Post fields for a button text, parsed once at save time. Returns (fields, errors)."""
+    rows, errors = compile_buttons(text)
+    return {'buttons_raw': text, 'buttons': rows, 'buttons_hash': buttons_hash(rows) if rows else None}, errors
+
+def button_errors_text(errors) -> str:
+    if not errors:
+        return ""
+    return "\n\n⚠️ বাটনে সমস্যা:\n" + "\n".join(f"• {e}" for e in errors)
+
+def _cached_markup(key, rows_factory):
+    markup = _markup_cache.get(key)
+    if markup is not None:
+        _markup_cache.move_to_end(key)
+        return markup
+    rows = rows_factory()
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton(**b) for b in row] for row in rows]) if rows else None
+    _markup_cache[key] = markup
+    if len(_markup_cache) > MARKUP_CACHE_SIZE:
+        _markup_cache.popitem(last=False)
+    return markup
+
+def keyboard_for_post(post: dict):
+    """InlineKeyboardMarkup for a post, built once per distinct button layout."""
+    if post.get('buttons_hash'):
+        return _cached_markup(post['buttons_hash'], lambda: post['buttons'])
+    raw = post.get('buttons_raw')
+    if not raw:
+        return None
+    # পুরনো পোস্ট (structured buttons ছাড়া) — raw টেক্সটের hash দিয়ে ক্যাশ
+    key = "raw:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return _cached_markup(key, lambda: compile_buttons(raw)[0])
+
+def parse_buttons_from_text(text):
+    rows, _ = compile_buttons(text)
+    if not rows:
+        return None
+    return _cached_markup(buttons_hash(rows), lambda: rows)
+
+# -----------------------
+# Listing index & pagination
+# -----------------------
+def post_title(p: dict) -> str:
+    # পোস্টের প্রথম 20টি অক্ষর টাইটেল হিসেবে দেখাবে
+    text = p.get('text') or ''
+    title = text[:20] + "..." if len(text) > 20 else text
+    return title if title.strip() else "Media Post"
+
+def channel_title(ch: dict) -> str:
+    return ("⛔ " if ch.get('disabled') else "") + ch['title'][:40]
+
+class SummaryIndex:
+    """Sorted ids plus precomputed list labels for one repository.
+
+    Kept current through the repository's change listeners, so listings never
+    rescan or re-truncate every record. `version` changes on every write and is
+    used to invalidate cached page keyboards.
+    """
+
+    def __init__(self, repo: Repository, label):
+        self.repo = repo
+        self.label = label
+        self.ids = []
+        self.labels = {}
+        self.version = 0
+        self.built = False
+        repo.listeners.append(self.on_change)
+
+    def on_change(self, op, item):
+        self.version += 1
+        if op == 'reset' or not self.built:
+            self.built = False
+            return
+        item_id = item['id']
+        if op == 'put':
+            if item_id not in self.labels:
+                bisect.insort(self.ids, item_id)
+            self.labels[item_id] = self.label(item)
+        elif op == 'del' and item_id in self.labels:
+            del self.labels[item_id]
+            self.ids.pop(bisect.bisect_left(self.ids, item_id))
+
+    def ensure_built(self):
+        if not self.built:
+            items = self.repo.all()
+            self.labels = {x['id']: self.label(x) for x in items}
+            self.ids = sorted(self.labels)
+            self.built = True
+
+    def __len__(self):
+        self.ensure_built()
+        return len(self.ids)
+
+    def page(self, cursor=None):
+        """Return (entries, prev_cursor, next_cursor, page_no, pages) for the page starting at `cursor`."""
+        self.ensure_built()
+        start = bisect.bisect_left(self.ids, cursor) if cursor is not None else 0
+        end = start + PAGE_SIZE
+        entries = [(i, self.labels[i]) for i in self.ids[start:end]]
+        prev_cursor = self.ids[max(0, start - PAGE_SIZE)] if start > 0 else None
+        next_cursor = self.ids[end] if end < len(self.ids) else None
+        pages = max(1, -(-len(self.ids) // PAGE_SIZE))
+        return entries, prev_cursor, next_cursor, start // PAGE_SIZE + 1, pages
+
+post_index = SummaryIndex(posts_repo, post_title)
+channel_index = SummaryIndex(channels_repo, channel_title)
+
+def _btn(text, data):
+    return InlineKeyboardButton(text, callback_data=data)
+
+# view name -> (index, row builder, footer rows)
+PAGED_VIEWS = {
+    'myposts': (post_index,
+                lambda i, t: [_btn(f"📄 {t}", f"view_post_{i}"), _btn("🗑 Delete", f"del_post_{i}")],
+                [[("📤 Send All Posts", "send_all_posts")]]),
+    'sendpost': (post_index,
+                 lambda i, t: [_btn(f"📤 {t}", f"send_post_{i}")],
+                 [[("📤 Send All Posts", "send_all_posts")]]),
+    'sendall': (post_index,
+                lambda i, t: [_btn(f"🌐 {t}", f"choose_all_{i}")],
+                [[("🌐 Send All Posts", "send_all_posts")]]),
+    'editpost': (post_index,
+                 lambda i, t: [_btn(f"✏️ {t}", f"edit_post_{i}")],
+                 []),
+    'delpost': (post_index,
+                lambda i, t: [_btn(f"Del {i}", f"del_post_{i}")],
+                []),
+    'channels': (channel_index,
+                 lambda i, t: [_btn(t, f"view_channel_{i}"), _btn("❌ Remove", f"remove_channel_{i}")],
+                 []),
+    'delchannel': (channel_index,
+                   lambda i, t: [_btn(t[:30], f"remove_channel_{i}")],
+                   []),
+}
+_page_cache = {}
+
+def paged_keyboard(view: str, cursor=None) -> InlineKeyboardMarkup:
+    """One page of a listing with prev/next buttons, cached until the data changes."""
+    index, row_builder, footer = PAGED_VIEWS[view]
+    key = (view, cursor)
+    cached = _page_cache.get(key)
+    if cached and cached[0] == index.version:
+        return cached[1]
+    entries, prev_cursor, next_cursor, page_no, pages = index.page(cursor)
+    kb = [row_builder(i, t) for i, t in entries]
+    if pages > 1:
+        nav = []
+        if prev_cursor is not None or page_no > 1:
+            nav.append(_btn("◀️ Prev", f"page:{view}:{'' if prev_cursor is None else prev_cursor}"))
+        nav.append(_btn(f"{page_no}/{pages}", "noop_page"))
+        if next_cursor is not None:
+            nav.append(_btn("Next ▶️", f"page:{view}:{next_cursor}"))
+        kb.append(nav)
+    kb.extend([_btn(text, data) for text, data in row] for row in footer)
+    kb.append([_btn("↩️ Back to Menu", "back_to_menu")])
+    markup = InlineKeyboardMarkup(kb)
+    if len(_page_cache) > 256:
+        _page_cache.clear()
+    _page_cache[key] = (index.version, markup)
+    return markup
+
+async def page_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    if q.data == "noop_page":
+        return
+    _, view, cursor = q.data.split(":", 2)
+    if view not in PAGED_VIEWS:
+        return
+    markup = paged_keyboard(view, int(cursor) if cursor else None)
+    try:
+        await q.edit_message_reply_markup(reply_markup=markup)
+    except BadRequest:
+        # একই কীবোর্ড হলে Telegram "message is not modified" দেয়
+        pass
 
 # -----------------------
 # UI keyboards
@@ -173,16 +1504,22 @@ async def forward_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ ফরওয়ার্ড করা মেসেজটি একটি চ্যানেলের নয়।", reply_markup=main_menu_kb())  
         return  
 
-    channels = load_json(CHANNEL_FILE)  
-    existing_ids = [c['id'] for c in channels]  
-    if chat.id in existing_ids:  
+    existing = channels_repo.get(chat.id)
+    if existing and existing.get('disabled'):
+        # আবার ফরওয়ার্ড করলে বন্ধ হওয়া চ্যানেল চালু হবে (admin rights ফিরিয়ে দেওয়ার পর)
+        channels_repo.update(chat.id, title=chat.title or str(chat.id), fail_count=0, disabled=False, disabled_at=None, last_error=None)
+        channel_health.status.pop(chat.id, None)
+        await update.message.reply_text(f"✅ চ্যানেল *{chat.title}* আবার চালু করা হয়েছে!", parse_mode=ParseMode.MARKDOWN, reply_markup=main_menu_kb())
+        context.user_data.pop('expecting_forward_for_add', None)
+        pop_step(context)
+        return
+    if existing:
         await update.message.reply_text(f"⚠️ চ্যানেল *{chat.title}* আগে থেকেই যুক্ত আছে।", parse_mode=ParseMode.MARKDOWN, reply_markup=main_menu_kb())  
         context.user_data.pop('expecting_forward_for_add', None)  
         pop_step(context)  
         return  
 
-    channels.append({'id': chat.id, 'title': chat.title or str(chat.id)})  
-    save_json(CHANNEL_FILE, channels)  
+    channels_repo.add({'id': chat.id, 'title': chat.title or str(chat.id)})
     await update.message.reply_text(f"✅ চ্যানেল *{chat.title}* সফলভাবে যুক্ত হয়েছে!", parse_mode=ParseMode.MARKDOWN, reply_markup=main_menu_kb())  
     context.user_data.pop('expecting_forward_for_add', None)  
     pop_step(context)
@@ -193,17 +1530,11 @@ async def forward_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def menu_channel_list_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    channels = load_json(CHANNEL_FILE)
-    if not channels:
+    if not len(channel_index):
         await q.message.reply_text("📭 এখনো কোনো চ্যানেল নেই। Add channel দিয়ে চ্যানেল যোগ করো।", reply_markup=main_menu_kb())
         return
 
-    kb = []  
-    for ch in channels:  
-        kb.append([InlineKeyboardButton(ch['title'][:40], callback_data=f"view_channel_{ch['id']}"),  
-                   InlineKeyboardButton("❌ Remove", callback_data=f"remove_channel_{ch['id']}")])  
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])  
-    await q.message.reply_text("📜 আপনার চ্যানেলগুলো:", reply_markup=InlineKeyboardMarkup(kb))
+    await q.message.reply_text("📜 আপনার চ্যানেলগুলো:", reply_markup=paged_keyboard('channels'))
 
 async def view_channel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -213,12 +1544,21 @@ async def view_channel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.message.reply_text("Invalid")
         return
     ch_id = int(parts[2])
-    channels = load_json(CHANNEL_FILE)
-    ch = next((c for c in channels if c['id'] == ch_id), None)
+    ch = channels_repo.get(ch_id)
     if not ch:
         await q.message.reply_text("Channel not found.", reply_markup=back_to_menu_kb())
         return
-    await q.message.reply_text(f"📣 Channel: *{ch['title']}*\nID: `{ch['id']}`", parse_mode=ParseMode.MARKDOWN, reply_markup=back_to_menu_kb())
+    text = f"📣 Channel: *{ch['title']}*\nID: `{ch['id']}`"
+    if ch.get('disabled'):
+        text += f"\n⛔ পাঠানো বন্ধ আছে: `{ch.get('last_error') or 'disabled'}`\nবটকে আবার admin করে চ্যানেল থেকে একটি মেসেজ ফরওয়ার্ড করলে চালু হবে।"
+    if ch.get('tags'):
+        text += "\n🏷 " + ", ".join(f"`#{t}`" for t in ch['tags'])
+    health = channel_health.status.get(ch_id)
+    if health:
+        ago = int((time.time() - health['checked_at']) / 60)
+        state = "✅ পোস্ট করা যায়" if health['can_post'] else f"❌ পোস্ট করা যায় না: `{health['error']}`"
+        text += f"\n🩺 {state} ({ago} মিনিট আগে চেক করা)"
+    await q.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=back_to_menu_kb())
 
 async def remove_channel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -228,22 +1568,241 @@ async def remove_channel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await q.message.reply_text("Invalid")
         return
-    channels = load_json(CHANNEL_FILE)
-    channels = [c for c in channels if c['id'] != ch_id]
-    save_json(CHANNEL_FILE, channels)
+    channels_repo.remove(ch_id)
     await q.message.reply_text("✅ চ্যানেল মুছে দেয়া হয়েছে।", reply_markup=main_menu_kb())
 
+# -----------------------
+# Channel tags and segments
+# -----------------------
+TAG_RE = re.compile(r"^[\w-]+$")
+SEGMENT_TOKEN_RE = re.compile(r"\s*([()&|!*]|[\w#-]+)")
+SEGMENT_WORDS = {"and": "&", "or": "|", "not": "!"}
+SEGMENT_MAX_DEPTH = 32
+
+def normalize_tag(text: str) -> str:
+    tag = text.strip().lstrip("#").lower()
+    if not TAG_RE.match(tag) or tag in SEGMENT_WORDS:
+        raise ValueError(f"ভুল ট্যাগ: {text}")
+    return tag
+
+class TagIndex:
+    """tag -> set of channel ids, kept current through the channels
+    repository's change listener, so a segment is resolved from the sets of
+    the tags it names instead of rescanning every channel."""
+
+    def __init__(self, repo: Repository):
+        self.repo = repo
+        self.by_tag = {}
+        self.tags_of = {}
+        self.built = False
+        repo.listeners.append(self.on_change)
+
+    def on_change(self, op, item):
+        if op == 'reset' or not self.built:
+            self.built = False
+            return
+        self._drop(item['id'])
+        if op == 'put':
+            self._put(item)
+
+    def _put(self, ch: dict):
+        tags = set(ch.get('tags') or ())
+        self.tags_of[ch['id']] = tags
+        for tag in tags:
+            self.by_tag.setdefault(tag, set()).add(ch['id'])
+
+    def _drop(self, ch_id):
+        for tag in self.tags_of.pop(ch_id, ()):
+            ids = self.by_tag.get(tag)
+            ids.discard(ch_id)
+            if not ids:
+                del self.by_tag[tag]
+
+    def _ensure_built(self):
+        if self.built:
+            return
+        self.by_tag = {}
+        self.tags_of = {}
+        for ch in self.repo.all():
+            self._put(ch)
+        self.built = True
+
+    def ids(self, tag: str) -> set:
+        self._ensure_built()
+        return self.by_tag.get(tag, set())
+
+    def all_ids(self) -> set:
+        self._ensure_built()
+        return set(self.tags_of)
+
+    def counts(self) -> dict:
+        self._ensure_built()
+        return {tag: len(ids) for tag, ids in sorted(self.by_tag.items())}
+
+channel_tags = TagIndex(channels_repo)
+
+def parse_segment(expr: str) -> set:
+    """Channel ids matching a tag expression, e.g. `(bn | hindi) & !nsfw`.
+
+    Operators: `&`/and, `|`/or, `!`/not, parentheses; `*` means every
+    channel. Only `!` and `*` need the full id set.
+    """
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = SEGMENT_TOKEN_RE.match(expr, pos)
+        if not m:
+            raise ValueError(f"বুঝতে পারিনি: {expr[pos:]}")
+        token = m.group(1)
+        tokens.append(SEGMENT_WORDS.get(token.lower(), token))
+        pos = m.end()
+
+    def peek():
+        return tokens[0] if tokens else None
+
+    def parse_or(depth):
+        ids = parse_and(depth)
+        while peek() == "|":
+            tokens.pop(0)
+            ids = ids | parse_and(depth)
+        return ids
+
+    def parse_and(depth):
+        ids = parse_not(depth)
+        while peek() == "&":
+            tokens.pop(0)
+            right = parse_not(depth)
+            ids = right & ids if len(right) < len(ids) else ids & right
+        return ids
+
+    def parse_not(depth):
+        # প্রতিটি ! বা ( এ রিকার্শন হয়; সীমা না থাকলে RecursionError হবে
+        if depth > SEGMENT_MAX_DEPTH:
+            raise ValueError(f"এক্সপ্রেশন খুব গভীর (সর্বোচ্চ {SEGMENT_MAX_DEPTH} ধাপ)")
+        if peek() == "!":
+            tokens.pop(0)
+            return channel_tags.all_ids() - parse_not(depth + 1)
+        if peek() == "(":
+            tokens.pop(0)
+            ids = parse_or(depth + 1)
+            if peek() != ")":
+                raise ValueError("বন্ধনী ')' মেলেনি")
+            tokens.pop(0)
+            return ids
+        if peek() == "*":
+            tokens.pop(0)
+            return channel_tags.all_ids()
+        if peek() is None or peek() in ("&", "|", ")"):
+            raise ValueError("ট্যাগ দরকার")
+        return set(channel_tags.ids(normalize_tag(tokens.pop(0))))
+
+    ids = parse_or(0)
+    if tokens:
+        raise ValueError(f"বাড়তি অংশ: {' '.join(tokens)}")
+    return ids
+
+def resolve_segment(expr: str) -> list:
+    """Channel records of a segment, in id order."""
+    return [ch for ch in (channels_repo.get(i) for i in sorted(parse_segment(expr))) if ch]
+
+async def tag_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await change_tags(update, context, add=True)
+
+async def untag_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await change_tags(update, context, add=False)
+
+async def change_tags(update: Update, context: ContextTypes.DEFAULT_TYPE, add: bool):
+    usage = f"ব্যবহার: /{'tag' if add else 'untag'} <channel_id> <tag> [tag ...]"
+    args = context.args or []
+    try:
+        ch_id = int(args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text(usage)
+        return
+    try:
+        tags = [normalize_tag(t) for t in args[1:]]
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}\n\n{usage}")
+        return
+    if not tags:
+        await update.message.reply_text(usage)
+        return
+    ch = channels_repo.get(ch_id)
+    if not ch:
+        await update.message.reply_text("❌ চ্যানেল পাওয়া যায়নি।", reply_markup=main_menu_kb())
+        return
+    current = set(ch.get('tags') or ())
+    current = current | set(tags) if add else current - set(tags)
+    channels_repo.update(ch_id, tags=sorted(current))
+    shown = ", ".join(f"#{t}" for t in sorted(current)) or "কোনো ট্যাগ নেই"
+    await update.message.reply_text(f"🏷 {channel_title(ch)}: {shown}", reply_markup=main_menu_kb())
+
+async def tags_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    counts = channel_tags.counts()
+    if not counts:
+        await update.message.reply_text("📭 কোনো ট্যাগ নেই। যোগ করতে: /tag <channel_id> <tag>", reply_markup=main_menu_kb())
+        return
+    lines = [f"#{tag} — {n}টি চ্যানেল" for tag, n in counts.items()]
+    await update.message.reply_text(
+        "🏷 Tags:\n\n" + "\n".join(lines) + "\n\nসেগমেন্ট দেখতে: /segment <expr>\nপাঠাতে: /sendto <post_id> <expr>",
+        reply_markup=main_menu_kb()
+    )
+
+async def segment_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    expr = " ".join(context.args or [])
+    if not expr:
+        await update.message.reply_text("ব্যবহার: /segment <expr>\nযেমন: /segment (bangla | hindi) & !adult")
+        return
+    try:
+        channels = resolve_segment(expr)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    lines = [f"• {channel_title(ch)} ({ch['id']})" for ch in channels[:20]]
+    if len(channels) > 20:
+        lines.append(f"… আরও {len(channels) - 20}টি")
+    await update.message.reply_text(f"🎯 {expr}: {len(channels)}টি চ্যানেল\n\n" + "\n".join(lines), reply_markup=main_menu_kb())
+
+async def sendto_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    usage = "ব্যবহার: /sendto <post_id[,post_id...]> <expr>\nযেমন: /sendto 12 bangla & !adult"
+    args = context.args or []
+    try:
+        post_ids = [int(x) for x in args[0].split(",") if x]
+    except (IndexError, ValueError):
+        await update.message.reply_text(usage)
+        return
+    expr = " ".join(args[1:])
+    if not post_ids or not expr:
+        await update.message.reply_text(usage)
+        return
+    missing = [pid for pid in post_ids if not posts_repo.get(pid)]
+    if missing:
+        await update.message.reply_text(f"❌ পোস্ট পাওয়া যায়নি: {', '.join(map(str, missing))}", reply_markup=main_menu_kb())
+        return
+    try:
+        channels = resolve_segment(expr)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if not channels:
+        await update.message.reply_text("❗ এই সেগমেন্টে কোনো চ্যানেল নেই।", reply_markup=main_menu_kb())
+        return
+    job = broadcast_jobs.submit(f"{len(post_ids)} post(s) → {expr}", update.effective_chat.id, post_ids, channels,
+                                album=MULTIPOST_ALBUMS and len(post_ids) > 1)
+    await update.message.reply_text(
+        f"📤 Job #{job.id}: {len(post_ids)}টি পোস্ট {len(channels)}টি চ্যানেলে পাঠানো শুরু হয়েছে। অবস্থা দেখতে /jobs",
+        reply_markup=main_menu_kb()
+    )
+
 # -----------------------
 # Create post flow
 # -----------------------
 async def menu_create_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    context.user_data.pop('creating_post', None)
-    context.user_data.pop('pending_file_id', None)
-    context.user_data.pop('pending_type', None)
     clear_steps(context)
-    context.user_data['creating_post'] = True
+    set_state(context, ConvState.IDLE)
+    set_state(context, ConvState.CREATING_POST)
     push_step(context, 'creating_post')
     await q.message.reply_text(
         "📝 পোস্ট তৈরি শুরু হয়েছে।\n\n"
@@ -254,239 +1813,185 @@ async def menu_create_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE
         reply_markup=step_back_kb()
     )
 
-async def save_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = context.user_data
-
-    if user.get('awaiting_buttons_for_post_id'):  
-        post_id = user.get('awaiting_buttons_for_post_id')  
-        buttons_raw = update.message.text or ""  
-        posts = load_json(POST_FILE)  
-        p = next((x for x in posts if x['id'] == post_id), None)  
-        if not p:  
-            await update.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())  
-            user.pop('awaiting_buttons_for_post_id', None)  
-            pop_step(context)  
-            return  
-        p['buttons_raw'] = buttons_raw  
-        save_json(POST_FILE, posts)  
-        # Multipost mode চেক করুন
-        is_multipost = user.get('creating_multipost', False)
-        if is_multipost:
-            kb = [
-                [InlineKeyboardButton("➕ Create New Post", callback_data="create_new_multipost")],
-                [InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_multipost")],
-                [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
-            ]
-            await update.message.reply_text(
-                f"✅ বাটন যোগ হয়েছে! পোস্ট #{post_id} সেভ হয়েছে। মোট পোস্ট: {len(user.get('multipost_list', []))}\n\nচাইলে নতুন পোস্ট তৈরি করো বা সব পাঠাও:",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(kb)
-            )
+def split_post_text(text: str):
+    """Split a message into (body, button lines): buttons start at the first
+    line that looks like `Label - url/popup/...` and run to the end."""
+    btn_lines = []
+    main_lines = []
+    started_buttons = False
+    for line in text.splitlines():
+        if " - " in line and (("http" in line) or ("t.me" in line) or "&&" in line or "popup:" in line or "alert:" in line or "share:" in line):
+            started_buttons = True
+            btn_lines.append(line)
+        elif started_buttons:
+            btn_lines.append(line)
         else:
-            kb = [  
-                [InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{post_id}")],  
-                [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]  
-            ]  
-            await update.message.reply_text(  
-                "✅ বাটন সংরক্ষণ হয়েছে! এখন চাইলে পোস্ট পাঠাও:",  
-                parse_mode=ParseMode.MARKDOWN,  
-                reply_markup=InlineKeyboardMarkup(kb)  
-            )  
-        user.pop('awaiting_buttons_for_post_id', None)  
-        pop_step(context)  
-        return  
+            main_lines.append(line)
+    return main_lines, btn_lines
 
-    if user.get('awaiting_caption_text'):  
-        caption = update.message.text or ""  
-        fid = user.get('pending_file_id')  
-        mtype = user.get('pending_type')  
-        posts = load_json(POST_FILE)  
-        posts.append({  
-            "id": len(posts) + 1,  
-            "text": caption,  
-            "buttons_raw": "",  
-            "media_id": fid,  
-            "media_type": mtype  
-        })  
-        save_json(POST_FILE, posts)  
-        new_id = len(posts)  
-        kb = [  
-            [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],  
-            [InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{new_id}")],  
-            [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]  
-        ]  
-        await update.message.reply_text("✅ ক্যাপশনসহ মিডিয়া সেভ হয়েছে! এখন চাইলে বাটন যোগ করো বা সরাসরি পাঠাও:", reply_markup=InlineKeyboardMarkup(kb))  
-        user.pop('awaiting_caption_text', None)  
-        user.pop('pending_file_id', None)  
-        user.pop('pending_type', None)  
-        pop_step(context)  
-        return  
+def add_to_multipost(context: ContextTypes.DEFAULT_TYPE, post_id: int) -> int:
+    context.user_data.setdefault('multipost_list', []).append(post_id)
+    return len(context.user_data['multipost_list'])
 
-    if user.get('awaiting_caption_text_multipost'):
-        caption = update.message.text or ""
-        fid = user.get('pending_file_id')
-        mtype = user.get('pending_type')
-        posts = load_json(POST_FILE)
-        new_id = len(posts) + 1
-        posts.append({
-            "id": new_id,
-            "text": caption,
-            "buttons_raw": "",
-            "media_id": fid,
-            "media_type": mtype
-        })
-        save_json(POST_FILE, posts)
-        if 'multipost_list' not in context.user_data:
-            context.user_data['multipost_list'] = []
-        context.user_data['multipost_list'].append(new_id)
+async def text_post_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = context.user_data
+    post_id = user.get('buttons_post_id')
+    back_to = ConvState.MULTIPOST if in_multipost(context) else ConvState.IDLE
+    buttons_raw = update.message.text or ""
+    fields, errors = button_fields(buttons_raw)
+    try:
+        async with posts_repo.transaction(post_id, user.get('post_version')) as draft:
+            draft.update(fields)
+    except KeyError:
+        await update.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())
+        pop_step(context)
+        return back_to
+    except VersionConflict:
+        await update.message.reply_text(POST_CHANGED_TEXT, reply_markup=main_menu_kb())
+        pop_step(context)
+        return back_to
+    if back_to == ConvState.MULTIPOST:
         kb = [
-            [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],
             [InlineKeyboardButton("➕ Create New Post", callback_data="create_new_multipost")],
             [InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_multipost")],
             [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
         ]
         await update.message.reply_text(
-            f"✅ ক্যাপশনসহ মিডিয়া পোস্ট #{new_id} সেভ হয়েছে! মোট পোস্ট: {len(context.user_data['multipost_list'])}\n\nচাইলে বাটন যোগ করো, নতুন পোস্ট তৈরি করো বা সব পাঠাও:",
+            f"✅ বাটন যোগ হয়েছে! পোস্ট #{post_id} সেভ হয়েছে। মোট পোস্ট: {len(user.get('multipost_list', []))}\n\nচাইলে নতুন পোস্ট তৈরি করো বা সব পাঠাও:" + button_errors_text(errors),
             reply_markup=InlineKeyboardMarkup(kb)
         )
-        user.pop('awaiting_caption_text_multipost', None)
-        user.pop('pending_file_id', None)
-        user.pop('pending_type', None)
-        pop_step(context)
-        return
+    else:
+        kb = apply_edit_kb(post_id, markup_only=True) + [
+            [InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{post_id}")],
+            [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
+        ]
+        await update.message.reply_text(
+            "✅ বাটন সংরক্ষণ হয়েছে! এখন চাইলে পোস্ট পাঠাও:" + button_errors_text(errors),
+            reply_markup=InlineKeyboardMarkup(kb)
+        )
+    user.pop('buttons_post_id', None)
+    pop_step(context)
+    return back_to
+
+async def text_post_caption(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = context.user_data
+    new_id = posts_repo.create({
+        "text": update.message.text or "",
+        "buttons_raw": "",
+        "media_id": user.get('pending_file_id'),
+        "media_type": user.get('pending_type')
+    })
+    kb = [
+        [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],
+        [InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{new_id}")],
+        [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
+    ]
+    await update.message.reply_text("✅ ক্যাপশনসহ মিডিয়া সেভ হয়েছে! এখন চাইলে বাটন যোগ করো বা সরাসরি পাঠাও:", reply_markup=InlineKeyboardMarkup(kb))
+    pop_step(context)
+    return ConvState.IDLE
+
+async def text_multipost_caption(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = context.user_data
+    new_id = posts_repo.create({
+        "text": update.message.text or "",
+        "buttons_raw": "",
+        "media_id": user.get('pending_file_id'),
+        "media_type": user.get('pending_type')
+    })
+    total = add_to_multipost(context, new_id)
+    kb = [
+        [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],
+        [InlineKeyboardButton("➕ Create New Post", callback_data="create_new_multipost")],
+        [InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_multipost")],
+        [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
+    ]
+    await update.message.reply_text(
+        f"✅ ক্যাপশনসহ মিডিয়া পোস্ট #{new_id} সেভ হয়েছে! মোট পোস্ট: {total}\n\nচাইলে বাটন যোগ করো, নতুন পোস্ট তৈরি করো বা সব পাঠাও:",
+        reply_markup=InlineKeyboardMarkup(kb)
+    )
+    user.pop('pending_file_id', None)
+    user.pop('pending_type', None)
+    pop_step(context)
+    return ConvState.MULTIPOST
+
+async def text_multipost_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    main_lines, btn_lines = split_post_text(update.message.text or "")
+    # অটো সেভ করবে
+    fields, errors = button_fields("\n".join(btn_lines).strip())
+    new_id = posts_repo.create({
+        "text": "\n".join(main_lines).strip(),
+        **fields,
+        "media_id": None,
+        "media_type": None
+    })
+    total = add_to_multipost(context, new_id)
+    kb = [
+        [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],
+        [InlineKeyboardButton("➕ Create New Post", callback_data="create_new_multipost")],
+        [InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_multipost")],
+        [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
+    ]
+    await update.message.reply_text(
+        f"✅ পোস্ট #{new_id} অটো সেভ হয়েছে! মোট পোস্ট: {total}\n\n"
+        "চাইলে বাটন যোগ করো বা নতুন পোস্ট তৈরি করো।" + button_errors_text(errors),
+        reply_markup=InlineKeyboardMarkup(kb)
+    )
+    return ConvState.MULTIPOST
 
-    if user.get('awaiting_buttons_for_multipost'):
-        buttons_raw = update.message.text or ""
-        # Last post ধরে নিন বা temp থেকে
-        if 'multipost_temp' in context.user_data:
-            temp_post = context.user_data['multipost_temp']
-            temp_post['buttons_raw'] = buttons_raw
-            posts = load_json(POST_FILE)
-            new_id = len(posts) + 1
-            temp_post['id'] = new_id
-            posts.append(temp_post)
-            save_json(POST_FILE, posts)
-            if 'multipost_list' not in context.user_data:
-                context.user_data['multipost_list'] = []
-            context.user_data['multipost_list'].append(new_id)
-            context.user_data.pop('multipost_temp', None)
-            kb = multipost_menu_kb(len(context.user_data['multipost_list']))
-            await update.message.reply_text(
-                f"✅ বাটন যোগ হয়েছে! পোস্ট #{new_id} সেভ হয়েছে। মোট পোস্ট: {len(context.user_data['multipost_list'])}",
-                reply_markup=kb
-            )
-        else:
-            await update.message.reply_text("❌ কোনো পোস্ট খুঁজে পাওয়া যায়নি।", reply_markup=main_menu_kb())
-        user.pop('awaiting_buttons_for_multipost', None)
+async def text_edit_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    pid = context.user_data.get('editing_post')
+    main_lines, btn_lines = split_post_text(update.message.text or "")
+    errors = []
+    try:
+        async with posts_repo.transaction(pid, context.user_data.get('post_version')) as draft:
+            if main_lines:
+                draft['text'] = "\n".join(main_lines).strip()
+            if btn_lines:
+                fields, errors = button_fields("\n".join(btn_lines).strip())
+                draft.update(fields)
+    except KeyError:
+        await update.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())
         pop_step(context)
-        return
+        return ConvState.IDLE
+    except VersionConflict:
+        await update.message.reply_text(POST_CHANGED_TEXT, reply_markup=main_menu_kb())
+        pop_step(context)
+        return ConvState.IDLE
+    apply_row = apply_edit_kb(pid, markup_only=not main_lines)
+    if apply_row:
+        kb = apply_row + [[InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]]
+        await update.message.reply_text("✅ পোস্ট আপডেট হয়েছে! চ্যানেলে থাকা কপিগুলোও বদলাতে চাও?" + button_errors_text(errors),
+                                        reply_markup=InlineKeyboardMarkup(kb))
+    else:
+        await update.message.reply_text("✅ পোস্ট আপডেট হয়েছে!" + button_errors_text(errors), reply_markup=main_menu_kb())
+    pop_step(context)
+    return ConvState.IDLE
 
-    if user.get('creating_multipost'):  
-        text = update.message.text or ""  
-        lines = text.splitlines()  
-        btn_lines = []  
-        main_lines = []  
-        started_buttons = False  
-        for line in lines:  
-            if " - " in line and (("http" in line) or ("t.me" in line) or "&&" in line or "popup:" in line or "alert:" in line or "share:" in line):  
-                started_buttons = True  
-                btn_lines.append(line)  
-            else:  
-                if started_buttons:  
-                    btn_lines.append(line)  
-                else:  
-                    main_lines.append(line)  
-        main_text = "\n".join(main_lines).strip()  
-        btn_text = "\n".join(btn_lines).strip()  
-          
-        # অটো সেভ করবে  
-        posts = load_json(POST_FILE)  
-        new_id = len(posts) + 1
-        new_post = {  
-            "id": new_id,
-            "text": main_text,  
-            "buttons_raw": btn_text,  
-            "media_id": None,  
-            "media_type": None  
-        }  
-        posts.append(new_post)  
-        save_json(POST_FILE, posts)  
-          
-        # মাল্টিপোস্ট লিস্টে যোগ করবে  
-        if 'multipost_list' not in context.user_data:  
-            context.user_data['multipost_list'] = []  
-        context.user_data['multipost_list'].append(new_id)  
-          
-        kb = [  
-            [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],  
-            [InlineKeyboardButton("➕ Create New Post", callback_data="create_new_multipost")],  
-            [InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_multipost")],  
-            [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]  
-        ]  
-        await update.message.reply_text(  
-            f"✅ পোস্ট #{new_id} অটো সেভ হয়েছে! মোট পোস্ট: {len(context.user_data['multipost_list'])}\n\n"
-            "চাইলে বাটন যোগ করো বা নতুন পোস্ট তৈরি করো।",  
-            reply_markup=InlineKeyboardMarkup(kb)  
-        )  
-        return  
+async def text_new_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    main_lines, btn_lines = split_post_text(update.message.text or "")
+    fields, errors = button_fields("\n".join(btn_lines).strip())
+    posts_repo.create({"text": "\n".join(main_lines).strip(), **fields, "media_id": None, "media_type": None})
+    await update.message.reply_text("✅ পোস্ট সংরক্ষণ করা হয়েছে!" + button_errors_text(errors), reply_markup=main_menu_kb())
+    pop_step(context)
+    return ConvState.IDLE
 
-    if user.get('editing_post'):  
-        pid = user.get('editing_post')  
-        text = update.message.text or ""  
-        posts = load_json(POST_FILE)  
-        p = next((x for x in posts if x['id'] == pid), None)  
-        if not p:  
-            await update.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())  
-            user.pop('editing_post', None)  
-            pop_step(context)  
-            return  
-        lines = text.splitlines()  
-        btn_lines = []  
-        main_lines = []  
-        started_buttons = False  
-        for line in lines:  
-            if " - " in line and (("http" in line) or ("t.me" in line) or "&&" in line or "popup:" in line or "alert:" in line):  
-                started_buttons = True  
-                btn_lines.append(line)  
-            else:  
-                if started_buttons:  
-                    btn_lines.append(line)  
-                else:  
-                    main_lines.append(line)  
-        if main_lines:  
-            p['text'] = "\n".join(main_lines).strip()  
-        if btn_lines:  
-            p['buttons_raw'] = "\n".join(btn_lines).strip()  
-        save_json(POST_FILE, posts)  
-        await update.message.reply_text("✅ পোস্ট আপডেট হয়েছে!", reply_markup=main_menu_kb())  
-        user.pop('editing_post', None)  
-        pop_step(context)  
-        return  
+# কোন অবস্থায় টেক্সট মেসেজ কী মানে; IDLE এ টেক্সট উপেক্ষা করা হয়
+TEXT_ROUTES = {
+    ConvState.CREATING_POST: text_new_post,
+    ConvState.POST_CAPTION: text_post_caption,
+    ConvState.POST_BUTTONS: text_post_buttons,
+    ConvState.EDITING_POST: text_edit_post,
+    ConvState.MULTIPOST: text_multipost_post,
+    ConvState.MULTIPOST_CAPTION: text_multipost_caption,
+    ConvState.MULTIPOST_BUTTONS: text_post_buttons,
+}
 
-    if user.get('creating_post'):  
-        text = update.message.text or ""  
-        posts = load_json(POST_FILE)  
-        lines = text.splitlines()  
-        btn_lines = []  
-        main_lines = []  
-        started_buttons = False  
-        for line in lines:  
-            if " - " in line and (("http" in line) or ("t.me" in line) or "&&" in line or "popup:" in line or "alert:" in line or "share:" in line):  
-                started_buttons = True  
-                btn_lines.append(line)  
-            else:  
-                if started_buttons:  
-                    btn_lines.append(line)  
-                else:  
-                    main_lines.append(line)  
-        main_text = "\n".join(main_lines).strip()  
-        btn_text = "\n".join(btn_lines).strip()  
-        posts.append({"id": len(posts) + 1, "text": main_text, "buttons_raw": btn_text, "media_id": None, "media_type": None})  
-        save_json(POST_FILE, posts)  
-        await update.message.reply_text("✅ পোস্ট সংরক্ষণ করা হয়েছে!", reply_markup=main_menu_kb())  
-        context.user_data.pop('creating_post', None)  
-        pop_step(context)  
+async def save_text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    route = TEXT_ROUTES.get(get_state(context))
+    if route is None:
         return
+    next_state = await route(update, context)
+    set_state(context, next_state)
 
 # -----------------------
 # Media handler
@@ -509,20 +2014,15 @@ async def media_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("❌ শুধু ছবি/ভিডিও/GIF পাঠাও।", reply_markup=main_menu_kb())  
         return  
 
-    if context.user_data.get('creating_multipost'):  
+    if in_multipost(context):  
         if msg.caption:  
             # অটো সেভ করবে  
-            posts = load_json(POST_FILE)  
-            new_id = len(posts) + 1
-            new_post = {  
-                "id": new_id,
-                "text": msg.caption,  
-                "buttons_raw": "",  
-                "media_id": fid,  
-                "media_type": mtype  
-            }  
-            posts.append(new_post)  
-            save_json(POST_FILE, posts)  
+            new_id = posts_repo.create({
+                "text": msg.caption,
+                "buttons_raw": "",
+                "media_id": fid,
+                "media_type": mtype
+            })
               
             # মাল্টিপোস্ট লিস্টে যোগ করবে  
             if 'multipost_list' not in context.user_data:  
@@ -554,16 +2054,12 @@ async def media_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return  
 
     if msg.caption:  
-        posts = load_json(POST_FILE)  
-        posts.append({  
-            "id": len(posts) + 1,  
-            "text": msg.caption,  
-            "buttons_raw": "",  
-            "media_id": fid,  
-            "media_type": mtype  
-        })  
-        save_json(POST_FILE, posts)  
-        new_id = len(posts)  
+        new_id = posts_repo.create({
+            "text": msg.caption,
+            "buttons_raw": "",
+            "media_id": fid,
+            "media_type": mtype
+        })
         kb = [  
             [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],  
             [InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{new_id}")],  
@@ -587,31 +2083,28 @@ async def caption_choice_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     data = q.data
     if data == "add_caption":
+        if not set_state(context, ConvState.POST_CAPTION):
+            await q.message.reply_text(STALE_BUTTON_TEXT, reply_markup=main_menu_kb())
+            return
         await q.message.reply_text("✍️ এখন ক্যাপশন লিখে পাঠান:", reply_markup=step_back_kb())
-        context.user_data['awaiting_caption_text'] = True
-        push_step(context, 'awaiting_caption_text', {'pending_file_id': context.user_data.get('pending_file_id')})
+        push_step(context, 'awaiting_caption_text', {'file_id': context.user_data.get('pending_file_id'), 'type': context.user_data.get('pending_type')})
     elif data == "skip_caption":
         fid = context.user_data.get('pending_file_id')
         mtype = context.user_data.get('pending_type')
-        posts = load_json(POST_FILE)
-        posts.append({
-            "id": len(posts) + 1,
+        new_id = posts_repo.create({
             "text": "",
             "buttons_raw": "",
             "media_id": fid,
             "media_type": mtype
         })
-        save_json(POST_FILE, posts)
-        new_id = len(posts)
         kb = [
             [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{new_id}")],
             [InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{new_id}")],
             [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
         ]
-        await q.message.reply_text("✅ মিডিয়া (ক্যাপশন ছাড়া) সেভ করা হয়েছে! এখন চাইলে বাটন যোগ করো বা সরাসরি পাঠাও:", reply_markup=InlineKeyboardMarkup(kb))
-        context.user_data.pop('pending_file_id', None)
-        context.user_data.pop('pending_type', None)
+        await q.message.reply_text("✅ মিডিয়া (ক্যাপশন ছাড়া) সেভ করা হয়েছে! এখন চাইলে বাটন যোগ করো বা সরাসরি পাঠাও:", reply_markup=InlineKeyboardMarkup(kb))
         pop_step(context)
+        set_state(context, ConvState.IDLE)
     else:
         await q.message.reply_text("❌ অজানা অপশন", reply_markup=main_menu_kb())
 
@@ -620,24 +2113,21 @@ async def caption_choice_multipost_cb(update: Update, context: ContextTypes.DEFA
     await q.answer()
     data = q.data
     if data == "add_caption_multipost":
+        if not set_state(context, ConvState.MULTIPOST_CAPTION):
+            await q.message.reply_text(STALE_BUTTON_TEXT, reply_markup=main_menu_kb())
+            return
         await q.message.reply_text("✍️ এখন ক্যাপশন লিখে পাঠান:", reply_markup=step_back_kb())
-        context.user_data['awaiting_caption_text_multipost'] = True
-        push_step(context, 'awaiting_caption_text_multipost')
+        push_step(context, 'awaiting_caption_text_multipost', {'file_id': context.user_data.get('pending_file_id'), 'type': context.user_data.get('pending_type')})
     elif data == "skip_caption_multipost":
         fid = context.user_data.get('pending_file_id')
         mtype = context.user_data.get('pending_type')
         # অটো সেভ করবে  
-        posts = load_json(POST_FILE)  
-        new_id = len(posts) + 1
-        new_post = {  
-            "id": new_id,
-            "text": "",  
-            "buttons_raw": "",  
-            "media_id": fid,  
-            "media_type": mtype  
-        }  
-        posts.append(new_post)  
-        save_json(POST_FILE, posts)  
+        new_id = posts_repo.create({
+            "text": "",
+            "buttons_raw": "",
+            "media_id": fid,
+            "media_type": mtype
+        })
           
         # মাল্টিপোস্ট লিস্টে যোগ করবে  
         if 'multipost_list' not in context.user_data:  
@@ -655,9 +2145,10 @@ async def caption_choice_multipost_cb(update: Update, context: ContextTypes.DEFA
             "চাইলে বাটন যোগ করো বা নতুন পোস্ট তৈরি করো।",  
             reply_markup=InlineKeyboardMarkup(kb)  
         )  
-        context.user_data.pop('pending_file_id', None)  
-        context.user_data.pop('pending_type', None)  
-        pop_step(context)  
+        context.user_data.pop('pending_file_id', None)
+        context.user_data.pop('pending_type', None)
+        pop_step(context)
+        set_state(context, ConvState.MULTIPOST)
     else:  
         await q.message.reply_text("❌ অজানা অপশন", reply_markup=main_menu_kb())
 
@@ -684,14 +2175,17 @@ async def add_buttons_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return  
       
     # পোস্ট exists কিনা চেক করুন  
-    posts = load_json(POST_FILE)  
-    p = next((x for x in posts if x['id'] == pid), None)  
+    p = posts_repo.get(pid)
     if not p:  
         await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())  
         return  
       
-    context.user_data['awaiting_buttons_for_post_id'] = pid  
-    push_step(context, 'awaiting_buttons_for_post_id', {'post_id': pid})  
+    if in_multipost(context):
+        set_state(context, ConvState.MULTIPOST_BUTTONS, buttons_post_id=pid, post_version=p.get('version', 0))
+        push_step(context, 'awaiting_buttons_for_multipost', {'post_id': pid})
+    else:
+        set_state(context, ConvState.POST_BUTTONS, buttons_post_id=pid, post_version=p.get('version', 0))
+        push_step(context, 'awaiting_buttons_for_post_id', {'post_id': pid})  
       
     await q.message.reply_text(  
         "✍️ এখন বাটন লাইন পাঠাও (উদাহরণ):\n\n"  
@@ -707,249 +2201,1469 @@ async def add_buttons_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -----------------------
 # My posts / view / delete / edit flows - UPDATED
 # -----------------------
+PREVIEW_CACHE_SIZE = 256
+
+class PreviewCache:
+    """Rendered preview caption and the preview message id per admin chat, for
+    each post version.
+
+    Kept current through the posts repository's change listener: an entry is
+    dropped as soon as its post is written or deleted, so a cached preview is
+    never shown for stale content.
+    """
+
+    def __init__(self, repo: Repository, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        repo.listeners.append(self.on_change)
+
+    def on_change(self, op, item):
+        if op == 'reset':
+            self.entries.clear()
+        else:
+            self.entries.pop(item['id'], None)
+
+    @staticmethod
+    def render(p: dict) -> str:
+        text_content = p.get('text', '')
+        if not text_content.strip():
+            text_content = "📷 Media Post"
+        text = f"*📝 পোস্ট #{p['id']}*\n\n{text_content}"
+        if p.get('buttons_raw'):
+            text += f"\n\n*বাটন:*\n`{p['buttons_raw']}`"
+        return text
+
+    def entry(self, p: dict) -> dict:
+        """{'version', 'caption', 'messages': {chat_id: message_id}} for the post as it is now."""
+        entry = self.entries.get(p['id'])
+        if entry is not None and entry['version'] == p.get('version', 0):
+            self.entries.move_to_end(p['id'])
+            return entry
+        entry = {'version': p.get('version', 0), 'caption': self.render(p), 'messages': {}}
+        self.entries[p['id']] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+post_previews = PreviewCache(posts_repo, PREVIEW_CACHE_SIZE)
+
 async def menu_my_posts_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    posts = load_json(POST_FILE)
-    if not posts:
+    if not len(post_index):
         await q.message.reply_text("📭 কোনো পোস্ট নেই। Create post দিয়ে পোস্ট যোগ করো।", reply_markup=back_to_menu_kb())
         return
 
-    kb = []  
-    for p in posts:  
-        # পোস্টের প্রথম 20টি অক্ষর টাইটেল হিসেবে দেখাবে  
-        title = p.get('text', 'No Title')[:20] + "..." if len(p.get('text', '')) > 20 else p.get('text', 'No Title')  
-        if not title.strip():  
-            title = "Media Post"  
-          
-        kb.append([  
-            InlineKeyboardButton(f"📄 {title}", callback_data=f"view_post_{p['id']}"),  
-            InlineKeyboardButton("🗑 Delete", callback_data=f"del_post_{p['id']}")  
-        ])  
-      
-    kb.append([InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_posts")])  
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])  
-      
-    await q.message.reply_text("🗂 আপনার পোস্টগুলো:", reply_markup=InlineKeyboardMarkup(kb))
+    await q.message.reply_text("🗂 আপনার পোস্টগুলো:", reply_markup=paged_keyboard('myposts'))
 
 async def view_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     pid = int(q.data.split("_")[-1])
-    posts = load_json(POST_FILE)
-    p = next((x for x in posts if x['id'] == pid), None)
+    p = posts_repo.get(pid)
     if not p:
         await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=back_to_menu_kb())
         return
 
-    # পোস্টের কন্টেন্ট দেখাবে  
-    text_content = p.get('text', '')  
-    if not text_content.strip():  
-        text_content = "📷 Media Post"  
-      
-    text = f"*📝 পোস্ট #{p['id']}*\n\n{text_content}"  
-      
-    if p.get('buttons_raw'):  
-        text += f"\n\n*বাটন:*\n`{p['buttons_raw']}`"  
-      
-    markup = parse_buttons_from_text(p.get('buttons_raw',''))  
-      
+    entry = post_previews.entry(p)
+    text = entry['caption']
+
     # একশন বাটন  
     action_kb = [  
         [InlineKeyboardButton("✏️ Edit Post", callback_data=f"edit_post_{p['id']}"),  
          InlineKeyboardButton("📤 Send Post", callback_data=f"send_post_{p['id']}")],  
         [InlineKeyboardButton("➕ Add Buttons", callback_data=f"add_buttons_{p['id']}"),  
-         InlineKeyboardButton("🗑 Delete", callback_data=f"del_post_{p['id']}")],  
+         InlineKeyboardButton("🗑 Delete", callback_data=f"del_post_{p['id']}")],
+        *retract_kb(p['id']),
         [InlineKeyboardButton("↩️ Back to Posts", callback_data="menu_my_posts")]  
     ]  
     action_markup = InlineKeyboardMarkup(action_kb)  
-      
+
+    chat_id = q.message.chat_id
+    cached_id = entry['messages'].get(chat_id)
+    if cached_id:
+        # আগের প্রিভিউ এই চ্যাটেই কপি হয়, মিডিয়া আবার পাঠাতে হয় না
+        try:
+            copied = await context.bot.copy_message(chat_id=chat_id, from_chat_id=chat_id, message_id=cached_id, reply_markup=action_markup)
+            entry['messages'][chat_id] = copied.message_id
+            return
+        except Exception:
+            entry['messages'].pop(chat_id, None)
+
     try:  
         if p.get('media_type') == "photo":  
-            await q.message.reply_photo(  
+            sent = await q.message.reply_photo(  
                 photo=p['media_id'],   
                 caption=text,   
                 parse_mode=ParseMode.MARKDOWN,   
                 reply_markup=action_markup  
             )  
         elif p.get('media_type') == "video":  
-            await q.message.reply_video(  
+            sent = await q.message.reply_video(  
                 video=p['media_id'],   
                 caption=text,   
                 parse_mode=ParseMode.MARKDOWN,   
                 reply_markup=action_markup  
             )  
         elif p.get('media_type') == "animation":  
-            await q.message.reply_animation(  
+            sent = await q.message.reply_animation(  
                 animation=p['media_id'],   
                 caption=text,   
                 parse_mode=ParseMode.MARKDOWN,   
                 reply_markup=action_markup  
             )  
         else:  
-            await q.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=action_markup)  
-    except Exception as e:  
-        await q.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=action_markup)
+            sent = await q.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=action_markup)  
+    except Exception:  
+        logging.warning("Preview for post %s failed, sending it as text", pid, exc_info=True)
+        sent = await q.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=action_markup)
+    entry['messages'][chat_id] = sent.message_id
+
+async def del_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    pid = int(q.data.split("_")[-1])
+    # আইডি বদলায় না, তাই চ্যাটে থাকা পুরনো বাটনগুলো ভুল পোস্টে যায় না
+    if posts_repo.tombstone(pid) is None:
+        await q.message.reply_text("❌ পোস্ট আগেই মুছে ফেলা হয়েছে।", reply_markup=main_menu_kb())
+        return
+    retract_row = retract_kb(pid)
+    if retract_row:
+        kb = retract_row + [[InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]]
+        await q.message.reply_text("✅ পোস্ট মুছে দেয়া হয়েছে। চ্যানেল থেকেও সরাতে চাও?", reply_markup=InlineKeyboardMarkup(kb))
+        return
+    await q.message.reply_text("✅ পোস্ট মুছে দেয়া হয়েছে।", reply_markup=main_menu_kb())
+
+async def menu_edit_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    if not len(post_index):
+        await q.message.reply_text("❗ কোনো পোস্ট নেই।", reply_markup=back_to_menu_kb())
+        return
+
+    await q.message.reply_text("✏️ কোন পোস্ট এডিট করতে চাও?", reply_markup=paged_keyboard('editpost'))
+
+async def choose_edit_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    pid = int(q.data.split("_")[-1])
+
+    # আগের পোস্ট কন্টেন্ট দেখাবে  
+    p = posts_repo.get(pid)
+    if not p:  
+        await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())  
+        return  
+      
+    # আগের কন্টেন্ট দেখাবে এডিট করার জন্য  
+    old_text = p.get('text', '')  
+    old_buttons = p.get('buttons_raw', '')  
+      
+    preview_text = f"*✏️ এডিট পোস্ট #{pid}*\n\n"  
+      
+    if old_text:  
+        preview_text += f"*বর্তমান টেক্সট:*\n{old_text}\n\n"  
+    else:  
+        preview_text += "*বর্তমান টেক্সট:* 📷 Media Post\n\n"  
+      
+    if old_buttons:  
+        preview_text += f"*বর্তমান বাটন:*\n`{old_buttons}`\n\n"  
+      
+    preview_text += "নতুন টেক্সট বা বাটন লাইন পাঠাও (বাটন ফরম্যাট দেখতে Guide চাপো):"  
+      
+    set_state(context, ConvState.EDITING_POST, editing_post=pid, post_version=p.get('version', 0))
+    push_step(context, 'editing_post', {'post_id': pid})  
+      
+    await q.message.reply_text(preview_text, parse_mode=ParseMode.MARKDOWN, reply_markup=step_back_kb())
+
+# -----------------------
+# Multipost - COMPLETELY FIXED
+# -----------------------
+async def menu_multipost_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    # রিসেট করবে
+    set_state(context, ConvState.MULTIPOST)
+    context.user_data['multipost_list'] = []
+    clear_steps(context)
+    push_step(context, 'creating_multipost')  
+      
+    await q.message.reply_text(  
+        "🧾 *Multipost Mode চালু হয়েছে!*\n\n"  
+        "এখন থেকে প্রতিটি পোস্ট *অটো সেভ* হবে।\n\n"  
+        "📝 আপনি যা করতে পারেন:\n"  
+        "• টেক্সট পোস্ট পাঠালে অটো সেভ হবে\n"  
+        "• মিডিয়া পাঠালে অটো সেভ হবে\n"  
+        "• বাটন যোগ করতে পারবেন\n"  
+        "• অনেকগুলো পোস্ট তৈরি করে একসাথে সেন্ড করতে পারবেন\n\n"  
+        "এখন প্রথম পোস্ট তৈরি শুরু করো:",  
+        parse_mode=ParseMode.MARKDOWN,  
+        reply_markup=step_back_kb()  
+    )
+
+async def create_new_multipost_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    set_state(context, ConvState.MULTIPOST)
+    push_step(context, 'creating_multipost')
+
+    await q.message.reply_text(  
+        "📝 নতুন পোস্ট তৈরি শুরু করো।\n\n"  
+        "মিডিয়া (ছবি/ভিডিও/GIF) অথবা টেক্সট পাঠাও।\n"  
+        "পোস্ট অটো সেভ হবে!",  
+        parse_mode=ParseMode.MARKDOWN,  
+        reply_markup=step_back_kb()  
+    )
+
+async def send_all_multipost_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    multipost_ids = context.user_data.get('multipost_list', [])  
+    if not multipost_ids:  
+        await q.message.reply_text("❌ কোনো পোস্ট তৈরি করা হয়নি।", reply_markup=main_menu_kb())  
+        return  
+      
+    # ব্যাকগ্রাউন্ডে পাঠাবে, হ্যান্ডলার সাথে সাথে উত্তর দেবে
+    job = broadcast_jobs.submit("Multipost", q.message.chat_id, multipost_ids, album=MULTIPOST_ALBUMS, staged=STAGING_CHAT_ID is not None)
+
+    # ক্লিন আপ
+    context.user_data.pop('multipost_list', None)
+    set_state(context, ConvState.IDLE)
+    clear_steps(context)
+
+    await q.message.reply_text(
+        f"📤 Job #{job.id}: {len(multipost_ids)}টি পোস্ট পাঠানো শুরু হয়েছে। অবস্থা দেখতে /jobs",
+        reply_markup=main_menu_kb()
+    )
+
+# -----------------------
+# Send helpers
+# -----------------------
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def block_for(self, seconds: float):
+        """Hand out no tokens for `seconds` (used for flood-control waits)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        """Full, unpaused and unused: a fresh bucket would behave the same."""
+        if self.lock.locked() or now < self.blocked_until:
+            return False
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class RateLimiter:
+    """Global bot budget plus one bucket per chat."""
+
+    def __init__(self, global_rate: float, per_chat_rate: float):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.chat_buckets = {}
+        self.sweep_at = 64
+
+    def bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.sweep_at:
+                self.sweep()
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def sweep(self):
+        # ভরা বাকেট ফেলে দিলে কিছু হারায় না — দরকার হলে নতুন করে বানানো হবে
+        now = time.monotonic()
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle(now)]:
+            del self.chat_buckets[chat_id]
+        self.sweep_at = max(64, 2 * len(self.chat_buckets))
+
+    async def acquire(self, chat_id):
+        # আগে চ্যানেলের টোকেন, তারপর গ্লোবাল — যাতে অপেক্ষার সময় গ্লোবাল বাজেট আটকে না থাকে
+        await self.bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def pause(self, chat_id, seconds: float):
+        self.bucket(chat_id).block_for(seconds)
+
+rate_limiter = RateLimiter(GLOBAL_RATE_PER_SEC, PER_CHAT_RATE_PER_SEC)
+
+# -----------------------
+# Delivery policy: retries and per-channel circuit breakers
+# -----------------------
+PERMANENT_BAD_REQUESTS = (
+    "chat not found", "not enough rights", "need administrator rights",
+    "have no rights", "chat_write_forbidden", "bot was kicked", "channel_private",
+)
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+def is_permanent_error(e: Exception) -> bool:
+    """Errors that will keep failing for this channel no matter how often we retry."""
+    if isinstance(e, (Forbidden, ChatMigrated)):
+        return True
+    if isinstance(e, BadRequest):
+        msg = str(e).lower()
+        return any(s in msg for s in PERMANENT_BAD_REQUESTS)
+    return False
+
+def is_transient_error(e: Exception) -> bool:
+    return isinstance(e, (TimedOut, NetworkError)) and not isinstance(e, BadRequest)
+
+async def deliver_with_policy(chat_id, send, limiter=None, retry_flood=True):
+    """Call `send()` under the rate limiter, honouring RetryAfter and retrying
+    transient errors with jittered exponential backoff.
+
+    With retry_flood=False a RetryAfter pauses the limiter and is raised at
+    once, so the caller can hand the send to another bot.
+    """
+    limiter = limiter or rate_limiter
+    attempt = 0
+    while True:
+        attempt += 1
+        await limiter.acquire(chat_id)
+        started = time.perf_counter()
+        try:
+            result = await send()
+            SEND_SECONDS.observe(time.perf_counter() - started, chat=chat_id)
+            return result
+        except RetryAfter as e:
+            SEND_ERRORS.inc(chat=chat_id, error="RetryAfter")
+            wait = retry_after_seconds(e) + 0.5
+            limiter.pause(chat_id, wait)
+            if not retry_flood or attempt >= MAX_SEND_ATTEMPTS:
+                raise
+            logging.warning("Flood control for %s, waiting %.1fs", chat_id, wait)
+        except Exception as e:
+            SEND_SECONDS.observe(time.perf_counter() - started, chat=chat_id)
+            SEND_ERRORS.inc(chat=chat_id, error=type(e).__name__)
+            if not is_transient_error(e) or attempt >= MAX_SEND_ATTEMPTS:
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+            await asyncio.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+def channel_usable(ch: dict) -> bool:
+    """Not known to be unusable by the health checker, and a closed breaker or
+    an open one whose cooldown has passed (one probe send)."""
+    if channel_health.known_unusable(ch['id']):
+        return False
+    if not ch.get('disabled'):
+        return True
+    return time.time() - ch.get('disabled_at', 0) >= BREAKER_COOLDOWN
+
+def note_channel_success(ch: dict):
+    if ch.get('fail_count') or ch.get('disabled'):
+        channels_repo.update(ch['id'], fail_count=0, disabled=False, disabled_at=None, last_error=None)
+
+def note_channel_failure(ch: dict, e: Exception):
+    current = channels_repo.get(ch['id']) or ch
+    fail_count = current.get('fail_count', 0) + 1
+    changes = {'fail_count': fail_count, 'last_error': f"{type(e).__name__}: {e}"}
+    if fail_count >= BREAKER_THRESHOLD:
+        if not current.get('disabled'):
+            logging.warning("Disabling channel %s after %s permanent failures", ch['id'], fail_count)
+        changes.update(disabled=True, disabled_at=time.time())
+    channels_repo.update(ch['id'], **changes)
+
+# -----------------------
+# Channel health checker
+# -----------------------
+def can_post_in(chat, member) -> tuple:
+    """(can_post, reason) for the bot's ChatMember in `chat`."""
+    status = member.status
+    if status == "creator":
+        return True, ""
+    if status in ("left", "kicked"):
+        return False, f"bot is {status}"
+    if chat.type == "channel":
+        if status == "administrator" and getattr(member, "can_post_messages", False):
+            return True, ""
+        return False, "bot can't post messages here (not an admin with post rights)"
+    if status == "administrator":
+        return True, ""
+    if status == "restricted" and not getattr(member, "can_send_messages", True):
+        return False, "bot is restricted from sending messages"
+    if chat.permissions is not None and chat.permissions.can_send_messages is False:
+        return False, "members can't send messages here"
+    return True, ""
+
+class ChannelHealth:
+    """Background get_chat/get_chat_member sweep over all channels.
+
+    Results live in memory for HEALTH_TTL seconds; broadcasts skip channels
+    known to be unusable without making a call. Title changes are written
+    back, a migrated chat is moved to its new id, and a channel that turns
+    out healthy again gets its breaker closed. Transient errors keep the
+    previous result. Runs on its own limiter so it never eats the broadcast
+    budget.
+    """
+
+    def __init__(self):
+        self.status = {}
+        self.application = None
+        self.task = None
+        self.limiter = RateLimiter(HEALTH_RATE_PER_SEC, HEALTH_RATE_PER_SEC)
+
+    def start(self, application):
+        self.application = application
+        self.task = asyncio.create_task(self.loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def loop(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception:
+                logging.exception("Channel health sweep failed")
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    def known_unusable(self, chat_id):
+        """The reason a channel can't be posted to, if a fresh check said so."""
+        st = self.status.get(chat_id)
+        if st and not st['can_post'] and time.time() - st['checked_at'] < HEALTH_TTL:
+            return st['error']
+        return None
+
+    def record(self, chat_id, can_post: bool, error: str = ""):
+        self.status[chat_id] = {'can_post': can_post, 'error': error, 'checked_at': time.time()}
+
+    async def check_all(self):
+        bot = self.application.bot
+        semaphore = asyncio.Semaphore(HEALTH_CONCURRENCY)
+
+        async def check(ch):
+            async with semaphore:
+                await self.check(bot, ch)
+
+        channels = channels_repo.all()
+        await asyncio.gather(*(check(ch) for ch in channels))
+        bad = sum(1 for ch in channels if self.known_unusable(ch['id']))
+        logging.info("Channel health: %s checked, %s unusable", len(channels), bad)
+
+    async def check(self, bot, ch: dict):
+        chat_id = ch['id']
+        try:
+            chat = await deliver_with_policy(chat_id, lambda: bot.get_chat(chat_id), self.limiter)
+            member = await deliver_with_policy(chat_id, lambda: bot.get_chat_member(chat_id, bot.id), self.limiter)
+        except ChatMigrated as e:
+            self.migrate(ch, e.new_chat_id)
+            return
+        except Exception as e:
+            if is_permanent_error(e):
+                self.record(chat_id, False, f"{type(e).__name__}: {e}")
+            else:
+                logging.warning("Health check for %s failed: %s", chat_id, e)
+            return
+        if chat.title and chat.title != ch.get('title'):
+            channels_repo.update(chat_id, title=chat.title)
+        can_post, reason = can_post_in(chat, member)
+        self.record(chat_id, can_post, reason)
+        if can_post:
+            # admin rights ফিরে এলে ব্রেকার খুলে রাখার দরকার নেই
+            note_channel_success(ch)
+
+    def migrate(self, ch: dict, new_id: int):
+        old = channels_repo.remove(ch['id'])
+        if old is None:
+            return
+        logging.warning("Channel %s migrated to %s", ch['id'], new_id)
+        if channels_repo.get(new_id) is None:
+            channels_repo.add({**old, 'id': new_id})
+        self.status.pop(ch['id'], None)
+
+channel_health = ChannelHealth()
+
+# -----------------------
+# Bot pool (BOT_POOL_TOKENS)
+# -----------------------
+class PoolMember:
+    def __init__(self, bot, limiter: RateLimiter, key: str):
+        self.bot = bot
+        self.limiter = limiter
+        self.key = key
+        self.cool_until = 0.0
+
+    def cooling(self) -> bool:
+        return time.time() < self.cool_until
+
+class BotPool:
+    """The main bot plus optional extra tokens, each with its own rate budget.
+
+    Channels are mapped to members by consistent hashing (POOL_VNODES points
+    per token on a ring), so adding a token only moves ~1/N of the channels.
+    A member that hits RetryAfter cools down and its sends go to the next
+    member on the ring.
+    """
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.members = []
+        self.ring = []
+        self.points = []
+
+    @property
+    def active(self) -> bool:
+        return len(self.members) > 1
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    async def start(self, main_bot):
+        self.members = [PoolMember(main_bot, rate_limiter, "main")]
+        for token in self.tokens:
+            if token == TOKEN:
+                continue
+            bot = Bot(token, request=api_request())
+            try:
+                await bot.initialize()
+            except Exception:
+                logging.exception("Pool token %s… could not log in, skipped", token.split(":")[0])
+                continue
+            limiter = RateLimiter(GLOBAL_RATE_PER_SEC, PER_CHAT_RATE_PER_SEC)
+            self.members.append(PoolMember(bot, limiter, token.split(":")[0]))
+        self.ring = sorted(
+            (self._hash(f"{member.key}#{v}"), n)
+            for n, member in enumerate(self.members) for v in range(POOL_VNODES)
+        )
+        self.points = [h for h, _ in self.ring]
+        if self.active:
+            print(f"✅ Bot pool: {len(self.members)} tokens")
+
+    async def stop(self):
+        for member in self.members[1:]:
+            try:
+                await member.bot.shutdown()
+            except Exception:
+                logging.exception("Pool bot %s shutdown failed", member.key)
+        self.members = []
+
+    def route(self, chat_id) -> list:
+        """Members in ring order starting at the chat's owner; cooling ones last."""
+        order = []
+        start = bisect.bisect(self.points, self._hash(str(chat_id)))
+        for k in range(len(self.ring)):
+            n = self.ring[(start + k) % len(self.ring)][1]
+            if n not in order:
+                order.append(n)
+                if len(order) == len(self.members):
+                    break
+        members = [self.members[n] for n in order]
+        return [m for m in members if not m.cooling()] + [m for m in members if m.cooling()]
+
+    def cool(self, member: PoolMember, seconds: float):
+        member.cool_until = max(member.cool_until, time.time() + seconds)
+
+bot_pool = BotPool(BOT_POOL_TOKENS)
+
+def has_callback_buttons(post: dict) -> bool:
+    rows = post['buttons'] if post.get('buttons_hash') else compile_buttons(post.get('buttons_raw'))[0]
+    return any('callback_data' in b for row in rows for b in row)
+
+def pool_eligible(post: dict) -> bool:
+    # file_id শুধু যে বট আপলোড পেয়েছে সেই বটের জন্য বৈধ, তাই মিডিয়া মূল বট পাঠাবে।
+    # popup/alert বাটনের ট্যাপ যে বট পাঠিয়েছে তার কাছে যায়, আর হ্যান্ডলার শুধু মূল বটে আছে
+    return bot_pool.active and not post.get("media_id") and not has_callback_buttons(post)
+
+async def deliver_via_pool(chat_id, send) -> tuple:
+    """Try pool members in ring order; returns (message, member).
+
+    RetryAfter cools the member and moves on; a permanent error from an extra
+    token (e.g. not admin there) also moves on, so only the last member's
+    error reaches the channel breaker.
+    """
+    members = bot_pool.route(chat_id)
+    for n, member in enumerate(members):
+        last = n == len(members) - 1
+        try:
+            msg = await deliver_with_policy(chat_id, lambda: send(member.bot), member.limiter, retry_flood=last)
+            return msg, member
+        except RetryAfter as e:
+            if last:
+                raise
+            bot_pool.cool(member, retry_after_seconds(e))
+            logging.warning("Token %s flood-limited for %s, moving on", member.key, chat_id)
+        except Exception as e:
+            if last or not is_permanent_error(e):
+                raise
+            logging.warning("Token %s can't post to %s (%s), moving on", member.key, chat_id, e)
+
+async def send_post_to_chat(bot, chat_id, post: dict, markup=None):
+    caption = post.get("text", "")
+    if post.get("media_type") == "photo":
+        return await bot.send_photo(chat_id=chat_id, photo=post["media_id"], caption=caption or None, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    elif post.get("media_type") == "video":
+        return await bot.send_video(chat_id=chat_id, video=post["media_id"], caption=caption or None, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    elif post.get("media_type") == "animation":
+        return await bot.send_animation(chat_id=chat_id, animation=post["media_id"], caption=caption or None, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    return await bot.send_message(chat_id=chat_id, text=caption or "(No text)", parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+async def send_post_to_channels(context: ContextTypes.DEFAULT_TYPE, post: dict, channels: list = None):
+    """Send one post to every channel concurrently.
+
+    `context` is anything with a `.bot` (handler context or the Application).
+
+    Returns {channel_id: {'ok': True, 'message_id': ...} | {'ok': False, 'error': ...}}.
+    """
+    if channels is None:
+        channels = channels_repo.all()
+    markup = keyboard_for_post(post)
+    use_pool = pool_eligible(post)
+    # প্রতিটি টোকেনের আলাদা বাজেট, তাই পুলে একসাথে বেশি পাঠানো যায়
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY * (len(bot_pool.members) if use_pool else 1))
+    results = {}
+
+    async def deliver(ch):
+        if not channel_usable(ch):
+            results[ch['id']] = skipped_result(ch)
+            return
+        async with semaphore:
+            try:
+                if use_pool:
+                    msg, member = await deliver_via_pool(ch['id'], lambda bot: send_post_to_chat(bot, ch['id'], post, markup))
+                    results[ch['id']] = {'ok': True, 'message_id': msg.message_id, 'bot': member.key}
+                else:
+                    msg = await deliver_with_policy(ch['id'], lambda: send_post_to_chat(context.bot, ch['id'], post, markup))
+                    results[ch['id']] = {'ok': True, 'message_id': msg.message_id}
+                note_channel_success(ch)
+            except Exception as e:
+                results[ch['id']] = failure_result(ch, e)
+
+    await asyncio.gather(*(deliver(ch) for ch in channels))
+    record_deliveries(post.get('id'), results)
+    return results
+
+def skipped_result(ch: dict) -> dict:
+    return {'ok': False, 'skipped': True, 'error': channel_health.known_unusable(ch['id']) or ch.get('last_error') or "disabled"}
+
+def failure_result(ch: dict, e: Exception) -> dict:
+    if is_permanent_error(e):
+        logging.warning("Send Error to channel %s: %s", ch.get('id'), e)
+        note_channel_failure(ch, e)
+    else:
+        logging.exception("Send Error to channel %s", ch.get('id'))
+    return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+def count_sent(results: dict) -> int:
+    return sum(1 for r in results.values() if r.get('ok'))
+
+def count_failed(results: dict) -> int:
+    return sum(1 for r in results.values() if not r.get('ok') and not r.get('skipped'))
+
+def count_skipped(results: dict) -> int:
+    return sum(1 for r in results.values() if r.get('skipped'))
+
+# -----------------------
+# Albums (send_media_group)
+# -----------------------
+ALBUM_MEDIA_TYPES = ("photo", "video")
+ALBUM_MAX_ITEMS = 10
+
+def album_eligible(post: dict) -> bool:
+    # বাটনসহ পোস্ট অ্যালবামে যায় না (media group এ reply_markup হয় না)
+    return post.get("media_type") in ALBUM_MEDIA_TYPES and keyboard_for_post(post) is None
+
+def album_batches(posts: list) -> list:
+    """Split posts into sending units: runs of up to 10 album-eligible posts,
+    everything else on its own. Order is kept."""
+    batches, run = [], []
+    for post in posts:
+        if album_eligible(post):
+            run.append(post)
+            if len(run) == ALBUM_MAX_ITEMS:
+                batches.append(run)
+                run = []
+            continue
+        if run:
+            batches.append(run)
+            run = []
+        batches.append([post])
+    if run:
+        batches.append(run)
+    return batches
 
-async def del_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
-    pid = int(q.data.split("_")[-1])
-    posts = load_json(POST_FILE)
-    posts = [p for p in posts if p['id'] != pid]
-    for i, p in enumerate(posts):
-        p['id'] = i + 1
-    save_json(POST_FILE, posts)
-    await q.message.reply_text("✅ পোস্ট মুছে দেয়া হয়েছে।", reply_markup=main_menu_kb())
+def input_media_for(post: dict):
+    cls = InputMediaPhoto if post.get("media_type") == "photo" else InputMediaVideo
+    return cls(media=post["media_id"], caption=post.get("text") or None, parse_mode=ParseMode.MARKDOWN)
 
-async def menu_edit_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q = update.callback_query
-    await q.answer()
-    posts = load_json(POST_FILE)
-    if not posts:
-        await q.message.reply_text("❗ কোনো পোস্ট নেই।", reply_markup=back_to_menu_kb())
-        return
+async def send_album_to_channels(context: ContextTypes.DEFAULT_TYPE, posts: list, channels: list = None):
+    """Send 2-10 album-eligible posts as one media group per channel.
 
-    kb = []  
-    for p in posts:  
-        # পোস্টের প্রথম 20টি অক্ষর টাইটেল হিসেবে দেখাবে  
-        title = p.get('text', 'No Title')[:20] + "..." if len(p.get('text', '')) > 20 else p.get('text', 'No Title')  
-        if not title.strip():  
-            title = "Media Post"  
-          
-        kb.append([InlineKeyboardButton(f"✏️ {title}", callback_data=f"edit_post_{p['id']}")])  
-      
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])  
-    await q.message.reply_text("✏️ কোন পোস্ট এডিট করতে চাও?", reply_markup=InlineKeyboardMarkup(kb))
+    Returns one result dict per post, same shape as send_post_to_channels().
+    If Telegram rejects the album itself for a channel, that channel gets the
+    posts one by one instead.
+    """
+    if len(posts) < 2:
+        return [await send_post_to_channels(context, post, channels) for post in posts]
+    if channels is None:
+        channels = channels_repo.all()
+    media = [input_media_for(post) for post in posts]
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    per_post = [{} for _ in posts]
 
-async def choose_edit_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def deliver(ch):
+        if not channel_usable(ch):
+            for results in per_post:
+                results[ch['id']] = skipped_result(ch)
+            return
+        async with semaphore:
+            try:
+                msgs = await deliver_with_policy(ch['id'], lambda: context.bot.send_media_group(chat_id=ch['id'], media=media))
+                for results, msg in zip(per_post, msgs):
+                    results[ch['id']] = {'ok': True, 'message_id': msg.message_id}
+                note_channel_success(ch)
+                return
+            except BadRequest as e:
+                if is_permanent_error(e):
+                    # একটাই API কল ব্যর্থ, তাই ব্রেকারে একবারই গোনা হবে
+                    failed = failure_result(ch, e)
+                    for results in per_post:
+                        results[ch['id']] = failed
+                    return
+                logging.warning("Album rejected by %s (%s), sending posts one by one", ch['id'], e)
+            except Exception as e:
+                failed = failure_result(ch, e)
+                for results in per_post:
+                    results[ch['id']] = failed
+                return
+            for post, results in zip(posts, per_post):
+                try:
+                    msg = await deliver_with_policy(ch['id'], lambda: send_post_to_chat(context.bot, ch['id'], post))
+                    results[ch['id']] = {'ok': True, 'message_id': msg.message_id}
+                    note_channel_success(ch)
+                except Exception as e:
+                    results[ch['id']] = failure_result(ch, e)
+
+    await asyncio.gather(*(deliver(ch) for ch in channels))
+    for post, results in zip(posts, per_post):
+        record_deliveries(post.get('id'), results)
+    return per_post
+
+# -----------------------
+# Staging replication (copy_messages)
+# -----------------------
+async def post_to_staging(bot, posts: list, album: bool) -> list:
+    """Send posts once to the staging chat; returns the staged message id per post."""
+    staged = []
+    for batch in (album_batches(posts) if album else [[p] for p in posts]):
+        if len(batch) > 1:
+            media = [input_media_for(p) for p in batch]
+            msgs = await deliver_with_policy(STAGING_CHAT_ID, lambda: bot.send_media_group(chat_id=STAGING_CHAT_ID, media=media))
+            staged.extend(m.message_id for m in msgs)
+        else:
+            post = batch[0]
+            msg = await deliver_with_policy(STAGING_CHAT_ID, lambda: send_post_to_chat(bot, STAGING_CHAT_ID, post))
+            staged.append(msg.message_id)
+    return staged
+
+def copy_units(posts: list, staged: list) -> list:
+    """Group staged messages into replication calls: runs of up to 100 posts
+    without buttons (one copy_messages each), posts with buttons on their own
+    (copy_message with reply_markup). Each unit is a list of post indexes."""
+    units, run = [], []
+    for i, post in enumerate(posts):
+        if keyboard_for_post(post) is None:
+            run.append(i)
+            if len(run) == COPY_BATCH_SIZE:
+                units.append(run)
+                run = []
+            continue
+        if run:
+            units.append(run)
+            run = []
+        units.append([i])
+    if run:
+        units.append(run)
+    return units
+
+async def replicate_via_staging(context: ContextTypes.DEFAULT_TYPE, posts: list, channels: list = None, album: bool = False):
+    """Deliver a multipost by staging it once and copying it to every channel.
+
+    Returns one result dict per post, same shape as send_post_to_channels().
+    Raises if the staging chat itself can't be posted to.
+    """
+    if channels is None:
+        channels = channels_repo.all()
+    bot = context.bot
+    staged = await post_to_staging(bot, posts, album)
+    units = copy_units(posts, staged)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    per_post = [{} for _ in posts]
+
+    async def copy_unit(ch, unit):
+        ids = [staged[i] for i in unit]
+        markup = keyboard_for_post(posts[unit[0]]) if len(unit) == 1 else None
+        if markup is not None:
+            msg = await deliver_with_policy(ch['id'], lambda: bot.copy_message(
+                chat_id=ch['id'], from_chat_id=STAGING_CHAT_ID, message_id=ids[0], reply_markup=markup))
+            return [msg.message_id]
+        msgs = await deliver_with_policy(ch['id'], lambda: bot.copy_messages(
+            chat_id=ch['id'], from_chat_id=STAGING_CHAT_ID, message_ids=ids))
+        return [m.message_id for m in msgs]
+
+    async def deliver(ch):
+        if not channel_usable(ch):
+            for results in per_post:
+                results[ch['id']] = skipped_result(ch)
+            return
+        async with semaphore:
+            for n, unit in enumerate(units):
+                try:
+                    msg_ids = await copy_unit(ch, unit)
+                except Exception as e:
+                    failed = failure_result(ch, e)
+                    # চ্যানেলটাই নষ্ট হলে বাকি ইউনিট পাঠিয়ে লাভ নেই
+                    rest = units[n:] if is_permanent_error(e) else [unit]
+                    for u in rest:
+                        for i in u:
+                            per_post[i][ch['id']] = failed
+                    if is_permanent_error(e):
+                        return
+                    continue
+                for k, i in enumerate(unit):
+                    per_post[i][ch['id']] = {'ok': True, 'message_id': msg_ids[k] if k < len(msg_ids) else None}
+                note_channel_success(ch)
+
+    await asyncio.gather(*(deliver(ch) for ch in channels))
+    for post, results in zip(posts, per_post):
+        record_deliveries(post.get('id'), results)
+    return per_post
+
+# -----------------------
+# Edit propagation (delivery ledger -> edit_message_*)
+# -----------------------
+def is_not_modified(e: Exception) -> bool:
+    return isinstance(e, BadRequest) and "message is not modified" in str(e).lower()
+
+def ledger_sender(bot, bot_key: str):
+    """(bot, limiter) that owns a recorded copy; only the sending bot may edit it."""
+    if bot_key in (None, "main"):
+        return bot, rate_limiter
+    for member in bot_pool.members:
+        if member.key == bot_key:
+            return member.bot, member.limiter
+    return None, None
+
+async def edit_copy(bot, chat_id, message_id, post: dict, markup, markup_only: bool):
+    if markup_only:
+        return await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
+    if post.get("media_id"):
+        return await bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=post.get("text") or None,
+                                              parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    return await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=post.get("text") or "(No text)",
+                                       parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+async def apply_edit_to_channels(context: ContextTypes.DEFAULT_TYPE, post: dict, markup_only: bool = False) -> dict:
+    """Edit every recorded copy of `post` in place, concurrently and under the
+    rate limiter of the bot that sent it.
+
+    markup_only=True only swaps the inline keyboard (edit_message_reply_markup).
+    Returns {(channel_id, message_id): {'ok': True} | {'ok': False, 'error': ...}};
+    "message is not modified" counts as success.
+    """
+    markup = keyboard_for_post(post)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY * max(1, len(bot_pool.members)))
+    results = {}
+
+    async def edit(chat_id, message_id, bot_key):
+        bot, limiter = ledger_sender(context.bot, bot_key)
+        if bot is None:
+            results[(chat_id, message_id)] = {'ok': False, 'error': f"token {bot_key} is not in the pool"}
+            return
+        async with semaphore:
+            try:
+                await deliver_with_policy(chat_id, lambda: edit_copy(bot, chat_id, message_id, post, markup, markup_only), limiter)
+                results[(chat_id, message_id)] = {'ok': True}
+            except Exception as e:
+                if is_not_modified(e):
+                    results[(chat_id, message_id)] = {'ok': True}
+                else:
+                    logging.warning("Edit failed for %s/%s: %s", chat_id, message_id, e)
+                    results[(chat_id, message_id)] = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    await asyncio.gather(*(edit(*copy) for copy in ledger_copies(post['id'])))
+    return results
+
+async def apply_edit_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    markup_only = q.data.startswith("apply_kb_")
     pid = int(q.data.split("_")[-1])
+    post = posts_repo.get(pid)
+    if not post:
+        await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())
+        return
+    copies = len(ledger_copies(pid))
+    if not copies:
+        await q.message.reply_text("❗ এই পোস্ট এখনো কোনো চ্যানেলে পাঠানো হয়নি।", reply_markup=main_menu_kb())
+        return
+    await q.message.reply_text(f"✏️ {copies}টি কপিতে এডিট পাঠানো হচ্ছে...")
+    chat_id = q.message.chat_id
 
-    # আগের পোস্ট কন্টেন্ট দেখাবে  
-    posts = load_json(POST_FILE)  
-    p = next((x for x in posts if x['id'] == pid), None)  
-    if not p:  
-        await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())  
-        return  
-      
-    # আগের কন্টেন্ট দেখাবে এডিট করার জন্য  
-    old_text = p.get('text', '')  
-    old_buttons = p.get('buttons_raw', '')  
-      
-    preview_text = f"*✏️ এডিট পোস্ট #{pid}*\n\n"  
-      
-    if old_text:  
-        preview_text += f"*বর্তমান টেক্সট:*\n{old_text}\n\n"  
-    else:  
-        preview_text += "*বর্তমান টেক্সট:* 📷 Media Post\n\n"  
-      
-    if old_buttons:  
-        preview_text += f"*বর্তমান বাটন:*\n`{old_buttons}`\n\n"  
-      
-    preview_text += "নতুন টেক্সট বা বাটন লাইন পাঠাও (বাটন ফরম্যাট দেখতে Guide চাপো):"  
-      
-    context.user_data['editing_post'] = pid  
-    push_step(context, 'editing_post', {'post_id': pid})  
-      
-    await q.message.reply_text(preview_text, parse_mode=ParseMode.MARKDOWN, reply_markup=step_back_kb())
+    async def run():
+        results = await apply_edit_to_channels(context, post, markup_only)
+        failed = [r['error'] for r in results.values() if not r['ok']]
+        text = f"✅ পোস্ট #{pid}: {len(results) - len(failed)}টি কপি এডিট হয়েছে"
+        if failed:
+            text += f", ❌ {len(failed)}টি ব্যর্থ\n{failed[0]}"
+        await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=main_menu_kb())
+
+    # হাজার চ্যানেলে সময় লাগে, তাই অ্যাডমিনের পরের আপডেট আটকে রাখা হয় না
+    context.application.create_task(run(), update=update)
 
 # -----------------------
-# Multipost - COMPLETELY FIXED
+# Retraction (delete_messages)
 # -----------------------
-async def menu_multipost_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+DELETE_BATCH_SIZE = 100
+PROGRESS_INTERVAL = 3
+
+def post_copies(post_ids: list) -> list:
+    """[(post_id, channel_id, message_id, bot_key), ...] from the ledger."""
+    return [(post_id, *copy) for post_id in post_ids for copy in ledger_copies(post_id)]
+
+async def retract_copies(context: ContextTypes.DEFAULT_TYPE, copies: list, on_progress=None) -> dict:
+    """Delete the given copies ((post_id, channel_id, message_id, bot_key)
+    tuples, see post_copies()) from the channels.
+
+    Copies are grouped per (channel, sending bot) so a whole multipost goes
+    in one delete_messages call (up to 100 ids) per channel; channels run
+    concurrently. on_progress(done, total) is awaited after each channel.
+    Returns {channel_id: {'ok': bool, 'deleted': n, 'error': ... (if any failed)}};
+    a channel with copies from several bots gets one merged entry.
+    """
+    groups = {}
+    for _, chat_id, message_id, bot_key in copies:
+        groups.setdefault((chat_id, bot_key), []).append(message_id)
+    pending = {}
+    for chat_id, _ in groups:
+        pending[chat_id] = pending.get(chat_id, 0) + 1
+    total = len(pending)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY * max(1, len(bot_pool.members)))
+    results = {}
+    removed = set()
+
+    async def retract(chat_id, bot_key, message_ids):
+        bot, limiter = ledger_sender(context.bot, bot_key)
+        # একই চ্যানেলে একাধিক বটের কপি থাকলে ফলাফল যোগ হয়, একটার এরর থাকলে চ্যানেল ব্যর্থ
+        result = results.setdefault(chat_id, {'ok': True, 'deleted': 0})
+        async with semaphore:
+            try:
+                if bot is None:
+                    raise RuntimeError(f"token {bot_key} is not in the pool")
+                for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+                    batch = message_ids[i:i + DELETE_BATCH_SIZE]
+                    await deliver_with_policy(chat_id, lambda: bot.delete_messages(chat_id=chat_id, message_ids=batch), limiter)
+                    removed.update((chat_id, m) for m in batch)
+                    result['deleted'] += len(batch)
+            except Exception as e:
+                logging.warning("Retract failed for %s: %s", chat_id, e)
+                result['ok'] = False
+                result.setdefault('error', f"{type(e).__name__}: {e}")
+        pending[chat_id] -= 1
+        if on_progress is not None:
+            await on_progress(sum(1 for n in pending.values() if n == 0), total)
+
+    await asyncio.gather(*(retract(chat_id, bot_key, ids) for (chat_id, bot_key), ids in groups.items()))
+    ledger_forget({post_id for post_id, _, _, _ in copies}, removed)
+    return results
+
+async def start_retraction(update: Update, context: ContextTypes.DEFAULT_TYPE, copies: list, label: str):
+    """Run retract_copies in the background, editing one progress message as channels finish."""
     q = update.callback_query
-    await q.answer()
+    channels = {chat_id for _, chat_id, _, _ in copies}
+    if not channels:
+        await q.message.reply_text("❗ চ্যানেলে এর কোনো কপি পাওয়া যায়নি।", reply_markup=main_menu_kb())
+        return
+    progress = await q.message.reply_text(f"🧹 {label}: 0/{len(channels)} চ্যানেল থেকে সরানো হচ্ছে...")
+    last_edit = [time.monotonic()]
 
-    # রিসেট করবে  
-    context.user_data['creating_multipost'] = True  
-    context.user_data['multipost_list'] = []  
-    clear_steps(context)  
-    push_step(context, 'creating_multipost')  
-      
-    await q.message.reply_text(  
-        "🧾 *Multipost Mode চালু হয়েছে!*\n\n"  
-        "এখন থেকে প্রতিটি পোস্ট *অটো সেভ* হবে।\n\n"  
-        "📝 আপনি যা করতে পারেন:\n"  
-        "• টেক্সট পোস্ট পাঠালে অটো সেভ হবে\n"  
-        "• মিডিয়া পাঠালে অটো সেভ হবে\n"  
-        "• বাটন যোগ করতে পারবেন\n"  
-        "• অনেকগুলো পোস্ট তৈরি করে একসাথে সেন্ড করতে পারবেন\n\n"  
-        "এখন প্রথম পোস্ট তৈরি শুরু করো:",  
-        parse_mode=ParseMode.MARKDOWN,  
-        reply_markup=step_back_kb()  
-    )
+    async def on_progress(done, total):
+        # প্রতি চ্যানেলে মেসেজ এডিট করলে নিজেরাই flood limit এ পড়ব
+        if done < total and time.monotonic() - last_edit[0] < PROGRESS_INTERVAL:
+            return
+        last_edit[0] = time.monotonic()
+        try:
+            await progress.edit_text(f"🧹 {label}: {done}/{total} চ্যানেল থেকে সরানো হচ্ছে...")
+        except Exception:
+            pass
 
-async def create_new_multipost_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def run():
+        results = await retract_copies(context, copies, on_progress)
+        failed = [r['error'] for r in results.values() if not r['ok']]
+        deleted = sum(r['deleted'] for r in results.values())
+        text = f"✅ {label}: {len(results) - len(failed)}টি চ্যানেল থেকে {deleted}টি মেসেজ সরানো হয়েছে"
+        if failed:
+            text += f", ❌ {len(failed)}টি চ্যানেলে ব্যর্থ\n{failed[0]}"
+        await context.bot.send_message(chat_id=q.message.chat_id, text=text, reply_markup=main_menu_kb())
+
+    context.application.create_task(run(), update=update)
+
+async def retract_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    pid = int(q.data.split("_")[-1])
+    # মুছে ফেলা পোস্টও সরানো যায়, লেজারে কপির হিসাব থাকে
+    await start_retraction(update, context, post_copies([pid]), f"পোস্ট #{pid}")
 
-    context.user_data['creating_multipost'] = True  
-    push_step(context, 'creating_multipost')  
-      
-    await q.message.reply_text(  
-        "📝 নতুন পোস্ট তৈরি শুরু করো।\n\n"  
-        "মিডিয়া (ছবি/ভিডিও/GIF) অথবা টেক্সট পাঠাও।\n"  
-        "পোস্ট অটো সেভ হবে!",  
-        parse_mode=ParseMode.MARKDOWN,  
-        reply_markup=step_back_kb()  
-    )
-
-async def send_all_multipost_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def retract_job_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    job = broadcast_jobs.jobs.get(int(q.data.split("_")[-1]))
+    if job is None:
+        await q.message.reply_text("❌ জবটি আর মনে নেই। পোস্ট ধরে ধরে Retract করো।", reply_markup=main_menu_kb())
+        return
+    # শুধু এই জব যেগুলো পাঠিয়েছে, আর যেগুলো এখনো লেজারে আছে (আগে সরানো হয়নি)
+    live = {(chat_id, message_id) for _, chat_id, message_id, _ in post_copies(job.post_ids)}
+    copies = [c for c in job.delivered if (c[1], c[2]) in live]
+    await start_retraction(update, context, copies, f"Job #{job.id}")
 
-    multipost_ids = context.user_data.get('multipost_list', [])  
-    if not multipost_ids:  
-        await q.message.reply_text("❌ কোনো পোস্ট তৈরি করা হয়নি।", reply_markup=main_menu_kb())  
-        return  
-      
-    posts = load_json(POST_FILE)  
-    total_sent = 0  
-      
-    await q.message.reply_text(f"📤 {len(multipost_ids)}টি পোস্ট পাঠানো হচ্ছে...")  
-      
-    for pid in multipost_ids:  
-        post = next((p for p in posts if p['id'] == pid), None)  
-        if post:  
-            sent = await send_post_to_channels(context, post)  
-            total_sent += sent  
-            # প্রতিটি পোস্ট সেন্ড হওয়ার পর একটু delay  
-            await asyncio.sleep(1)  
-      
-    # ক্লিন আপ  
-    context.user_data.pop('multipost_list', None)  
-    context.user_data.pop('creating_multipost', None)  
-    clear_steps(context)  
-      
-    await q.message.reply_text(  
-        f"✅ মোট {len(multipost_ids)}টি পোস্ট {total_sent} চ্যানেলে পাঠানো হয়েছে!",  
-        reply_markup=main_menu_kb()  
-    )
+def retract_kb(post_id: int) -> list:
+    if not ledger_copies(post_id):
+        return []
+    return [[InlineKeyboardButton("🧹 Retract from all channels", callback_data=f"retract_post_{post_id}")]]
+
+def apply_edit_kb(post_id: int, markup_only: bool = False) -> list:
+    """Row with the "Apply edit to all channels" button, if the post was ever sent."""
+    if not ledger_copies(post_id):
+        return []
+    data = f"apply_kb_{post_id}" if markup_only else f"apply_edit_{post_id}"
+    return [[InlineKeyboardButton("🔁 Apply edit to all channels", callback_data=data)]]
 
 # -----------------------
-# Send helpers
+# Broadcast jobs (background worker pool)
 # -----------------------
-async def send_post_to_channels(context: ContextTypes.DEFAULT_TYPE, post: dict):
-    channels = load_json(CHANNEL_FILE)
-    sent = 0
-    for ch in channels:
+class BroadcastJob:
+    def __init__(self, job_id: int, title: str, chat_id, post_ids: list, channels: list = None, album: bool = False, staged: bool = False):
+        self.id = job_id
+        self.title = title
+        self.chat_id = chat_id
+        self.post_ids = list(post_ids)
+        self.channels = channels
+        self.album = album
+        self.staged = staged
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done_posts = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.error = None
+        # (post_id, channel_id, message_id, bot_key) this job delivered, for retraction
+        self.delivered = []
+
+    def record(self, posts: list, batch_results: list):
+        for post, results in zip(posts, batch_results):
+            self.sent += count_sent(results)
+            self.failed += count_failed(results)
+            self.skipped += count_skipped(results)
+            self.delivered.extend((post['id'], ch_id, r['message_id'], r.get('bot', "main"))
+                                  for ch_id, r in results.items() if r.get('ok') and r.get('message_id'))
+        self.done_posts += len(posts)
+
+    def summary(self) -> str:
+        icon = {"queued": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}.get(self.status, "•")
+        line = f"{icon} #{self.id} {self.title} — {self.status} ({self.done_posts}/{len(self.post_ids)} posts, sent {self.sent}, failed {self.failed}, skipped {self.skipped})"
+        if self.started_at:
+            line += f" {(self.finished_at or time.time()) - self.started_at:.1f}s"
+        return line
+
+class BroadcastJobQueue:
+    """Runs broadcasts on a small asyncio worker pool so handlers return at once."""
+
+    def __init__(self, workers: int, history: int = 50):
+        self.workers = workers
+        self.history = history
+        self.jobs = OrderedDict()
+        self.next_id = 1
+        self.queue = None
+        self.tasks = []
+        self.application = None
+
+    def start(self, application):
+        self.application = application
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, title: str, chat_id, post_ids: list, channels: list = None, album: bool = False, staged: bool = False) -> BroadcastJob:
+        job = BroadcastJob(self.next_id, title, chat_id, post_ids, channels, album, staged)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status in ("queued", "running"):
+                break
+            self.jobs.popitem(last=False)
+        self.queue.put_nowait(job)
+        return job
+
+    def pending(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run(job)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job: BroadcastJob):
+        job.status = "running"
+        job.started_at = time.time()
         try:
-            markup = parse_buttons_from_text(post.get('buttons_raw', ''))
-            caption = post.get("text", "")
-            if post.get("media_type") == "photo":
-                await context.bot.send_photo(chat_id=ch['id'], photo=post["media_id"], caption=caption or None, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
-            elif post.get("media_type") == "video":
-                await context.bot.send_video(chat_id=ch['id'], video=post["media_id"], caption=caption or None, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
-            elif post.get("media_type") == "animation":
-                await context.bot.send_animation(chat_id=ch['id'], animation=post["media_id"], caption=caption or None, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
-            else:
-                await context.bot.send_message(chat_id=ch['id'], text=caption or "(No text)", parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
-            sent += 1
+            channels = job.channels if job.channels is not None else channels_repo.all()
+            posts = [p for p in (posts_repo.get(pid) for pid in job.post_ids) if p]
+            job.done_posts += len(job.post_ids) - len(posts)
+            if job.staged and STAGING_CHAT_ID and len(posts) > 1:
+                try:
+                    batch_results = await replicate_via_staging(self.application, posts, channels, job.album)
+                except Exception:
+                    logging.exception("Staging chat %s unusable, sending job %s directly", STAGING_CHAT_ID, job.id)
+                else:
+                    job.record(posts, batch_results)
+                    posts = []
+            batches = album_batches(posts) if job.album else [[p] for p in posts]
+            for batch in batches:
+                if len(batch) > 1:
+                    batch_results = await send_album_to_channels(self.application, batch, channels)
+                else:
+                    batch_results = [await send_post_to_channels(self.application, batch[0], channels)]
+                job.record(batch, batch_results)
+            job.status = "done"
         except Exception as e:
-            logging.exception("Send Error to channel %s", ch.get('id'))
-    return sent
+            logging.exception("Broadcast job %s failed", job.id)
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        job.finished_at = time.time()
+        try:
+            await self.application.bot.send_message(
+                chat_id=job.chat_id,
+                text=f"{'✅' if job.status == 'done' else '❌'} Job #{job.id}: {len(job.post_ids)}টি পোস্ট {job.sent} বার পাঠানো হয়েছে, ❌ ব্যর্থ: {job.failed}, ⛔ বন্ধ চ্যানেল: {job.skipped}"
+                     + (f"\n{job.error}" if job.error else ""),
+                reply_markup=self.report_kb(job)
+            )
+        except Exception:
+            logging.exception("Could not report job %s", job.id)
+
+    @staticmethod
+    def report_kb(job: BroadcastJob) -> InlineKeyboardMarkup:
+        if not job.delivered:
+            return main_menu_kb()
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("🧹 Retract from all channels", callback_data=f"retract_job_{job.id}")],
+            [InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")]
+        ])
+
+broadcast_jobs = BroadcastJobQueue(BROADCAST_WORKERS)
+register_metric(Gauge("bot_broadcast_queue_depth", "Broadcast jobs waiting for a worker.", broadcast_jobs.pending))
+register_metric(Gauge("bot_broadcast_jobs_running", "Broadcast jobs being sent right now.",
+                      lambda: sum(1 for j in list(broadcast_jobs.jobs.values()) if j.status == "running")))
+
+async def jobs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    jobs = list(broadcast_jobs.jobs.values())[-15:]
+    if not jobs:
+        await update.message.reply_text("📭 কোনো ব্রডকাস্ট জব নেই।", reply_markup=main_menu_kb())
+        return
+    lines = [job.summary() for job in reversed(jobs)]
+    await update.message.reply_text("🧾 Broadcast jobs:\n\n" + "\n".join(lines), reply_markup=main_menu_kb())
+
+# -----------------------
+# Scheduled posts (scheduled_posts.json)
+# -----------------------
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+def parse_cron_field(text: str, lo: int, hi: int) -> set:
+    values = set()
+    for part in text.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError("step must be positive")
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"{part} is out of range {lo}-{hi}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronRule:
+    """Five-field cron rule: minute hour day-of-month month day-of-week (0 or 7 = Sunday)."""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError("cron needs 5 fields: minute hour day month weekday")
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_cron_field(f, lo, hi) for f, (lo, hi) in zip(fields, CRON_FIELDS)
+        )
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def day_matches(self, d) -> bool:
+        if d.month not in self.months:
+            return False
+        dom = d.day in self.days
+        dow = (d.isoweekday() % 7) in self.weekdays
+        # cron নিয়ম: দুটোই সীমিত হলে যেকোনো একটি মিললেই চলবে
+        if self.any_day:
+            return dow
+        if self.any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, after: float, tz) -> float:
+        """Epoch seconds of the first fire time strictly after `after`."""
+        local = datetime.fromtimestamp(after, tz).replace(second=0, microsecond=0, tzinfo=None) + timedelta(minutes=1)
+        day = local.date()
+        for _ in range(366 * 5):
+            if self.day_matches(day):
+                for hour in sorted(self.hours):
+                    if day == local.date() and hour < local.hour:
+                        continue
+                    for minute in sorted(self.minutes):
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate < local:
+                            continue
+                        fire = tz.localize(candidate).timestamp()
+                        if fire > after:
+                            return fire
+            day += timedelta(days=1)
+        raise ValueError(f"cron rule '{self.expr}' never fires")
+
+def schedule_tz(sched: dict):
+    return pytz.timezone(sched.get('tz') or SCHEDULE_TZ)
+
+def next_run_for(sched: dict, after: float):
+    if sched.get('cron'):
+        return CronRule(sched['cron']).next_after(after, schedule_tz(sched))
+    return None
+
+class PostScheduler:
+    """Fires scheduled posts from a min-heap of (next_run, schedule_id).
+
+    Only the earliest entry has a timer on the application's JobQueue; adding
+    or removing a schedule re-arms that single timer instead of polling the file.
+    Heap entries are validated against schedules_repo when popped, so removals
+    are lazy.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.application = None
+        self.timer = None
+        self.armed_for = None
+
+    def start(self, application):
+        self.application = application
+        now = time.time()
+        self.heap = []
+        for sched in schedules_repo.all():
+            if not sched.get('active', True) or 'next_run' not in sched or 'post_id' not in sched:
+                continue
+            if sched['next_run'] <= now:
+                self.catch_up(sched, now)
+                sched = schedules_repo.get(sched['id'])
+                if not sched.get('active', True):
+                    continue
+            heapq.heappush(self.heap, (sched['next_run'], sched['id']))
+        self.arm()
+
+    def catch_up(self, sched: dict, now: float):
+        """Run a schedule missed while the bot was down (once, not per missed slot)."""
+        if now - sched['next_run'] <= SCHEDULE_CATCHUP_SECONDS:
+            logging.info("Catching up missed schedule #%s", sched['id'])
+            self.fire(sched)
+        else:
+            logging.warning("Skipping schedule #%s, missed by more than %ss", sched['id'], SCHEDULE_CATCHUP_SECONDS)
+        self.advance(sched, now)
+
+    def stop(self):
+        if isinstance(self.timer, asyncio.TimerHandle):
+            self.timer.cancel()
+        elif self.timer is not None:
+            self.timer.schedule_removal()
+        self.timer = None
+        self.armed_for = None
+
+    def add(self, sched: dict):
+        heapq.heappush(self.heap, (sched['next_run'], sched['id']))
+        self.arm()
+
+    def remove(self, sched_id: int):
+        schedules_repo.update(sched_id, active=False)
+        self.arm()
+
+    def _valid(self, entry) -> bool:
+        when, sched_id = entry
+        sched = schedules_repo.get(sched_id)
+        return bool(sched and sched.get('active', True) and sched['next_run'] == when)
+
+    def arm(self):
+        while self.heap and not self._valid(self.heap[0]):
+            heapq.heappop(self.heap)
+        if self.application is None:
+            return
+        head = self.heap[0][0] if self.heap else None
+        if head == self.armed_for:
+            return
+        self.stop()
+        if head is None:
+            return
+        delay = max(0.0, head - time.time())
+        job_queue = self.application.job_queue
+        if job_queue is not None:
+            self.timer = job_queue.run_once(self.on_timer, when=delay, name="post-scheduler")
+        else:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(delay, lambda: asyncio.ensure_future(self.on_timer(None)))
+        self.armed_for = head
+
+    async def on_timer(self, context):
+        self.timer = None
+        self.armed_for = None
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self._valid(entry):
+                continue
+            sched = schedules_repo.get(entry[1])
+            self.fire(sched)
+            sched = self.advance(sched, now)
+            if sched.get('active', True):
+                heapq.heappush(self.heap, (sched['next_run'], sched['id']))
+        self.arm()
+
+    def fire(self, sched: dict):
+        if not posts_repo.get(sched['post_id']):
+            logging.warning("Schedule #%s points at missing post %s", sched['id'], sched['post_id'])
+            return
+        broadcast_jobs.submit(f"Schedule #{sched['id']}", sched['chat_id'], [sched['post_id']])
+
+    def advance(self, sched: dict, now: float) -> dict:
+        nxt = next_run_for(sched, max(now, sched['next_run']))
+        if nxt is None:
+            return schedules_repo.update(sched['id'], active=False, last_run=now)
+        return schedules_repo.update(sched['id'], next_run=nxt, last_run=now)
+
+post_scheduler = PostScheduler()
+register_metric(Gauge("bot_scheduled_posts_pending", "Entries in the scheduler heap.", lambda: len(post_scheduler.heap)))
+
+def format_ts(ts: float, tz) -> str:
+    return datetime.fromtimestamp(ts, tz).strftime("%Y-%m-%d %H:%M")
+
+async def schedule_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    usage = (
+        "ব্যবহার:\n"
+        "/schedule <post_id> <YYYY-MM-DD> <HH:MM>\n"
+        "/schedule <post_id> cron <min> <hour> <day> <month> <weekday>\n\n"
+        f"Timezone: {SCHEDULE_TZ}"
+    )
+    args = context.args or []
+    try:
+        post_id = int(args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text(usage)
+        return
+    if not posts_repo.get(post_id):
+        await update.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=main_menu_kb())
+        return
+    tz = pytz.timezone(SCHEDULE_TZ)
+    sched = {'post_id': post_id, 'chat_id': update.effective_chat.id, 'tz': SCHEDULE_TZ, 'cron': None, 'active': True, 'last_run': None}
+    try:
+        if len(args) == 7 and args[1] == "cron":
+            sched['cron'] = " ".join(args[2:])
+            sched['next_run'] = CronRule(sched['cron']).next_after(time.time(), tz)
+        elif len(args) == 3:
+            run_at = tz.localize(datetime.strptime(f"{args[1]} {args[2]}", "%Y-%m-%d %H:%M"))
+            sched['next_run'] = run_at.timestamp()
+            if sched['next_run'] <= time.time():
+                await update.message.reply_text("❌ সময়টি অতীতে।")
+                return
+        else:
+            await update.message.reply_text(usage)
+            return
+    except ValueError as e:
+        await update.message.reply_text(f"❌ ভুল সময়/cron: {e}\n\n{usage}")
+        return
+    sched_id = schedules_repo.create(sched)
+    post_scheduler.add(schedules_repo.get(sched_id))
+    # SCHEDULE_TZ এ '_' থাকতে পারে (America/New_York), তাই Markdown ছাড়া পাঠানো হয়
+    kind = f"cron {sched['cron']}" if sched['cron'] else "একবার"
+    await update.message.reply_text(
+        f"⏰ Schedule #{sched_id}: পোস্ট #{post_id} — {kind}\nপরবর্তী: {format_ts(sched['next_run'], tz)} ({SCHEDULE_TZ})",
+        reply_markup=main_menu_kb()
+    )
+
+async def schedules_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    active = [s for s in schedules_repo.all() if s.get('active', True)]
+    if not active:
+        await update.message.reply_text("📭 কোনো শিডিউল নেই।", reply_markup=main_menu_kb())
+        return
+    lines = []
+    for s in sorted(active, key=lambda s: s['next_run']):
+        kind = f"cron {s['cron']}" if s.get('cron') else "once"
+        lines.append(f"#{s['id']} → post #{s['post_id']} ({kind}) next {format_ts(s['next_run'], schedule_tz(s))}")
+    await update.message.reply_text("⏰ Schedules:\n\n" + "\n".join(lines) + "\n\nবাতিল করতে: /unschedule <id>", reply_markup=main_menu_kb())
+
+async def unschedule_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        sched_id = int((context.args or [])[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("ব্যবহার: /unschedule <id>")
+        return
+    sched = schedules_repo.get(sched_id)
+    if not sched or not sched.get('active', True):
+        await update.message.reply_text("❌ শিডিউল পাওয়া যায়নি।", reply_markup=main_menu_kb())
+        return
+    post_scheduler.remove(sched_id)
+    await update.message.reply_text(f"🗑 Schedule #{sched_id} বাতিল হয়েছে।", reply_markup=main_menu_kb())
 
 # -----------------------
 # Send post
@@ -957,28 +3671,14 @@ async def send_post_to_channels(context: ContextTypes.DEFAULT_TYPE, post: dict):
 async def menu_send_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    posts = load_json(POST_FILE)
-    channels = load_json(CHANNEL_FILE)
-    if not posts:
+    if not len(post_index):
         await q.message.reply_text("❗ কোনো পোস্ট নেই। আগে Create post দিয়ে পোস্ট যোগ করো।", reply_markup=back_to_menu_kb())
         return
-    if not channels:
-        await q.message.reply_text("❗ কোনো চ্যানেল নেই। Add channel দিয়ে যোগ করো।", reply_markup=back_to_menu_kb())
+    if not len(channel_index):
+        await q.message.reply_text("❗ কোনো চ্যানেল নেই। Add channel দিয়ে যোগ করো।", reply_markup=back_to_menu_kb())
         return
 
-    kb = []  
-    for p in posts:  
-        # পোস্টের প্রথম 20টি অক্ষর টাইটেল হিসেবে দেখাবে  
-        title = p.get('text', 'No Title')[:20] + "..." if len(p.get('text', '')) > 20 else p.get('text', 'No Title')  
-        if not title.strip():  
-            title = "Media Post"  
-          
-        kb.append([InlineKeyboardButton(f"📤 {title}", callback_data=f"send_post_{p['id']}")])  
-      
-    kb.append([InlineKeyboardButton("📤 Send All Posts", callback_data="send_all_posts")])  
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])  
-      
-    await q.message.reply_text("📤 কোন পোস্ট পাঠাতে চাও?", reply_markup=InlineKeyboardMarkup(kb))
+    await q.message.reply_text("📤 কোন পোস্ট পাঠাতে চাও?", reply_markup=paged_keyboard('sendpost'))
 
 async def send_post_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -991,64 +3691,44 @@ async def send_post_selected(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await q.message.reply_text("❌ পোস্ট আইডি পাওয়া যায়নি।", reply_markup=back_to_menu_kb())  
         return  
 
-    posts = load_json(POST_FILE)  
-    post = next((x for x in posts if x["id"] == post_id), None)  
+    post = posts_repo.get(post_id)
     if not post:  
         await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=back_to_menu_kb())  
         return  
 
-    sent = await send_post_to_channels(context, post)  
-    await q.message.reply_text(f"✅ পোস্ট {sent} চ্যানেলে পাঠানো হয়েছে।", reply_markup=main_menu_kb())
+    job = broadcast_jobs.submit(f"Post #{post_id}", q.message.chat_id, [post_id])
+    await q.message.reply_text(f"📤 Job #{job.id}: পোস্ট পাঠানো শুরু হয়েছে। অবস্থা দেখতে /jobs", reply_markup=main_menu_kb())
 
 async def send_all_posts_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    posts = load_json(POST_FILE)
+    posts = posts_repo.all()
     if not posts:
         await q.message.reply_text("❗ কোনো পোস্ট নেই।", reply_markup=back_to_menu_kb())
         return
 
-    total_sent = 0  
-    for post in posts:  
-        sent = await send_post_to_channels(context, post)  
-        total_sent += sent  
-        # প্রতিটি পোস্ট সেন্ড হওয়ার পর একটু delay  
-        await asyncio.sleep(1)  
-      
-    await q.message.reply_text(f"✅ সমস্ত {len(posts)}টি পোস্ট {total_sent} চ্যানেলে পাঠানো হয়েছে!", reply_markup=main_menu_kb())
+    job = broadcast_jobs.submit("All posts", q.message.chat_id, [p['id'] for p in posts])
+    await q.message.reply_text(f"📤 Job #{job.id}: সমস্ত {len(posts)}টি পোস্ট পাঠানো শুরু হয়েছে। অবস্থা দেখতে /jobs", reply_markup=main_menu_kb())
 
 async def menu_send_all_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    posts = load_json(POST_FILE)
-    if not posts:
+    if not len(post_index):
         await q.message.reply_text("❗ কোনো পোস্ট নেই।", reply_markup=back_to_menu_kb())
         return
-    kb = []
-    for p in posts:
-        # পোস্টের প্রথম 20টি অক্ষর টাইটেল হিসেবে দেখাবে
-        title = p.get('text', 'No Title')[:20] + "..." if len(p.get('text', '')) > 20 else p.get('text', 'No Title')
-        if not title.strip():
-            title = "Media Post"
-
-        kb.append([InlineKeyboardButton(f"🌐 {title}", callback_data=f"choose_all_{p['id']}")])  
-      
-    kb.append([InlineKeyboardButton("🌐 Send All Posts", callback_data="send_all_posts")])  
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])  
-      
-    await q.message.reply_text("কোন পোস্ট All Channels-এ পাঠাবো?", reply_markup=InlineKeyboardMarkup(kb))
+
+    await q.message.reply_text("কোন পোস্ট All Channels-এ পাঠাবো?", reply_markup=paged_keyboard('sendall'))
 
 async def choose_all_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     pid = int(q.data.split("_")[-1])
-    posts = load_json(POST_FILE)
-    post = next((x for x in posts if x['id'] == pid), None)
+    post = posts_repo.get(pid)
     if not post:
         await q.message.reply_text("❌ পোস্ট পাওয়া যায়নি।", reply_markup=back_to_menu_kb())
         return
-    sent = await send_post_to_channels(context, post)
-    await q.message.reply_text(f"✅ পোস্ট {sent} চ্যানেলে পাঠানো হয়েছে!", reply_markup=main_menu_kb())
+    job = broadcast_jobs.submit(f"Post #{pid}", q.message.chat_id, [pid])
+    await q.message.reply_text(f"📤 Job #{job.id}: পোস্ট পাঠানো শুরু হয়েছে। অবস্থা দেখতে /jobs", reply_markup=main_menu_kb())
 
 # -----------------------
 # Button guide and generic callbacks
@@ -1092,6 +3772,7 @@ async def back_to_menu_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     clear_steps(context)
+    set_state(context, ConvState.IDLE)
     await q.message.reply_text("↩️ মূল মেনুতে ফিরে আসা হলো", reply_markup=main_menu_kb())
 
 # -----------------------
@@ -1104,25 +3785,12 @@ async def step_back_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prev = peek_prev_step(context)
     if current:
         name = current.get('name')
-        if name == 'awaiting_caption_text':
-            context.user_data.pop('awaiting_caption_text', None)
-            context.user_data.pop('pending_file_id', None)
-            context.user_data.pop('pending_type', None)
-        elif name == 'awaiting_buttons_for_post_id':
-            context.user_data.pop('awaiting_buttons_for_post_id', None)
-        elif name == 'creating_multipost':
-            context.user_data.pop('creating_multipost', None)
+        if name == 'creating_multipost':
             context.user_data.pop('multipost_list', None)
-        elif name == 'editing_post':
-            context.user_data.pop('editing_post', None)
         elif name == 'expecting_forward_for_add':
             context.user_data.pop('expecting_forward_for_add', None)
-        elif name == 'awaiting_caption_text_multipost':
-            context.user_data.pop('awaiting_caption_text_multipost', None)
-            context.user_data.pop('pending_file_id', None)
-            context.user_data.pop('pending_type', None)
-        elif name == 'awaiting_buttons_for_multipost':
-            context.user_data.pop('awaiting_buttons_for_multipost', None)
+    set_state(context, ConvState.IDLE)
+    restore_step_state(context, prev)
 
     if not prev:  
         await q.message.reply_text("↩️ আর কোন পূর্বের ধাপ নেই — মূল মেনুতে ফিরে গেলাম।", reply_markup=main_menu_kb())  
@@ -1189,79 +3857,368 @@ async def menu_delete_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start_delete_post_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    posts = load_json(POST_FILE)
-    if not posts:
+    if not len(post_index):
         await q.message.reply_text("No posts to delete.", reply_markup=back_to_menu_kb())
         return
-    kb = [[InlineKeyboardButton(f"Del {p['id']}", callback_data=f"del_post_{p['id']}")] for p in posts]
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])
-    await q.message.reply_text("Choose post to delete:", reply_markup=InlineKeyboardMarkup(kb))
+    await q.message.reply_text("Choose post to delete:", reply_markup=paged_keyboard('delpost'))
 
 async def start_delete_channel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    channels = load_json(CHANNEL_FILE)
-    if not channels:
+    if not len(channel_index):
         await q.message.reply_text("No channels to remove.", reply_markup=back_to_menu_kb())
         return
-    kb = [[InlineKeyboardButton(c['title'][:30], callback_data=f"remove_channel_{c['id']}")] for c in channels]
-    kb.append([InlineKeyboardButton("↩️ Back to Menu", callback_data="back_to_menu")])
-    await q.message.reply_text("Choose channel to remove:", reply_markup=InlineKeyboardMarkup(kb))
+    await q.message.reply_text("Choose channel to remove:", reply_markup=paged_keyboard('delchannel'))
 
 # -----------------------
 # Handler registration
 # -----------------------
+# -----------------------
+# Callback router
+# -----------------------
+class CallbackRouter:
+    """Routes callback_data with dict lookups instead of trying regexes in order.
+
+    An exact match wins. Otherwise the route key is everything up to the first
+    ':' (`page:`, `popup:`) or up to the last '_' (`view_post_12` -> `view_post_`).
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+
+    def on(self, data: str, callback):
+        self.exact[data] = timed_callback(callback, data)
+
+    def on_prefix(self, prefix: str, callback):
+        self.prefixes[prefix] = timed_callback(callback, prefix + "*")
+
+    @staticmethod
+    def prefix_of(data: str) -> str:
+        if ":" in data:
+            return data[:data.index(":") + 1]
+        head, sep, _ = data.rpartition("_")
+        return head + sep
+
+    def resolve(self, data: str):
+        return self.exact.get(data) or self.prefixes.get(self.prefix_of(data))
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        q = update.callback_query
+        callback = self.resolve(q.data or "")
+        if callback is None:
+            logging.info("No route for callback %r", q.data)
+            await q.answer()
+            return
+        await callback(update, context)
+
+def build_callback_router() -> CallbackRouter:
+    router = CallbackRouter()
+    for data, callback in (
+        ("menu_add_channel", menu_add_channel_cb),
+        ("menu_channel_list", menu_channel_list_cb),
+        ("menu_create_post", menu_create_post_cb),
+        ("menu_my_posts", menu_my_posts_cb),
+        ("menu_send_post", menu_send_post_cb),
+        ("menu_send_all", menu_send_all_cb),
+        ("menu_multipost", menu_multipost_cb),
+        ("menu_edit_post", menu_edit_post_cb),
+        ("menu_delete", menu_delete_cb),
+        ("menu_guide", menu_guide_cb),
+        ("back_to_menu", back_to_menu_cb),
+        ("noop_page", page_cb),
+        ("add_caption", caption_choice_cb),
+        ("skip_caption", caption_choice_cb),
+        ("start_delete_post", start_delete_post_cb),
+        ("start_delete_channel", start_delete_channel_cb),
+        ("noop", generic_callback_cb),
+        ("step_back", step_back_cb),
+        ("send_all_posts", send_all_posts_cb),
+        ("add_caption_multipost", caption_choice_multipost_cb),
+        ("skip_caption_multipost", caption_choice_multipost_cb),
+        ("create_new_multipost", create_new_multipost_cb),
+        ("send_all_multipost", send_all_multipost_cb),
+    ):
+        router.on(data, callback)
+    for prefix, callback in (
+        ("page:", page_cb),
+        ("view_channel_", view_channel_cb),
+        ("remove_channel_", remove_channel_cb),
+        ("view_post_", view_post_cb),
+        ("del_post_", del_post_cb),
+        ("edit_post_", choose_edit_post_cb),
+        ("send_post_", send_post_selected),
+        ("choose_all_", choose_all_cb),
+        ("add_buttons_", add_buttons_cb),
+        ("apply_edit_", apply_edit_cb),
+        ("apply_kb_", apply_edit_cb),
+        ("retract_post_", retract_post_cb),
+        ("retract_job_", retract_job_cb),
+        ("popup:", generic_callback_cb),
+        ("alert:", generic_callback_cb),
+    ):
+        router.on_prefix(prefix, callback)
+    return router
+
 def register_handlers(application):
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(menu_add_channel_cb, pattern="^menu_add_channel$"))
-    application.add_handler(CallbackQueryHandler(menu_channel_list_cb, pattern="^menu_channel_list$"))
-    application.add_handler(CallbackQueryHandler(menu_create_post_cb, pattern="^menu_create_post$"))
-    application.add_handler(CallbackQueryHandler(menu_my_posts_cb, pattern="^menu_my_posts$"))
-    application.add_handler(CallbackQueryHandler(menu_send_post_cb, pattern="^menu_send_post$"))
-    application.add_handler(CallbackQueryHandler(menu_send_all_cb, pattern="^menu_send_all$"))
-    application.add_handler(CallbackQueryHandler(menu_multipost_cb, pattern="^menu_multipost$"))
-    application.add_handler(CallbackQueryHandler(menu_edit_post_cb, pattern="^menu_edit_post$"))
-    application.add_handler(CallbackQueryHandler(menu_delete_cb, pattern="^menu_delete$"))
-    application.add_handler(CallbackQueryHandler(menu_guide_cb, pattern="^menu_guide$"))
-    application.add_handler(CallbackQueryHandler(back_to_menu_cb, pattern="^back_to_menu$"))
-    application.add_handler(CallbackQueryHandler(view_channel_cb, pattern=r"^view_channel_"))
-    application.add_handler(CallbackQueryHandler(remove_channel_cb, pattern=r"^remove_channel_"))
-    application.add_handler(CallbackQueryHandler(view_post_cb, pattern=r"^view_post_"))
-    application.add_handler(CallbackQueryHandler(del_post_cb, pattern=r"^del_post_"))
-    application.add_handler(CallbackQueryHandler(choose_edit_post_cb, pattern=r"^edit_post_"))
-    application.add_handler(CallbackQueryHandler(send_post_selected, pattern=r"^send_post_"))
-    application.add_handler(CallbackQueryHandler(choose_all_cb, pattern=r"^choose_all_"))
-    application.add_handler(CallbackQueryHandler(add_buttons_cb, pattern=r"^add_buttons_"))
-    application.add_handler(CallbackQueryHandler(caption_choice_cb, pattern=r"^(add_caption|skip_caption)$"))
-    application.add_handler(CallbackQueryHandler(start_delete_post_cb, pattern=r"^start_delete_post$"))
-    application.add_handler(CallbackQueryHandler(start_delete_channel_cb, pattern=r"^start_delete_channel$"))
-    application.add_handler(CallbackQueryHandler(generic_callback_cb, pattern=r"^(popup:|alert:|noop)"))
+    application.add_handler(CommandHandler("jobs", jobs_cmd))
+    application.add_handler(CommandHandler("schedule", schedule_cmd))
+    application.add_handler(CommandHandler("schedules", schedules_cmd))
+    application.add_handler(CommandHandler("unschedule", unschedule_cmd))
+    application.add_handler(CommandHandler("tag", tag_cmd))
+    application.add_handler(CommandHandler("untag", untag_cmd))
+    application.add_handler(CommandHandler("tags", tags_cmd))
+    application.add_handler(CommandHandler("segment", segment_cmd))
+    application.add_handler(CommandHandler("sendto", sendto_cmd))
     application.add_handler(MessageHandler(filters.FORWARDED & filters.ChatType.PRIVATE, forward_handler))
     application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO | filters.ANIMATION, media_handler))
     application.add_handler(MessageHandler(filters.TEXT & filters.ChatType.PRIVATE, save_text_handler))
-    application.add_handler(CallbackQueryHandler(step_back_cb, pattern=r"^step_back$"))
-    application.add_handler(CallbackQueryHandler(send_all_posts_cb, pattern="^send_all_posts$"))
-    application.add_handler(CallbackQueryHandler(caption_choice_multipost_cb, pattern=r"^(add_caption_multipost|skip_caption_multipost)$"))
-    application.add_handler(CallbackQueryHandler(create_new_multipost_cb, pattern="^create_new_multipost$"))
-    application.add_handler(CallbackQueryHandler(send_all_multipost_cb, pattern="^send_all_multipost$"))
+    instrument_handlers(application)
+    # রাউটার প্রতিটি রুট আলাদাভাবে মাপে, তাই instrument এর পরে যোগ হয়
+    application.add_handler(CallbackQueryHandler(build_callback_router().dispatch))
 
 # -----------------------
 # Main
 # -----------------------
+async def on_startup(application):
+    await bot_pool.start(application.bot)
+    broadcast_jobs.start(application)
+    post_scheduler.start(application)
+    channel_health.start(application)
+
+async def on_shutdown(application):
+    post_scheduler.stop()
+    await channel_health.stop()
+    await broadcast_jobs.stop()
+    await bot_pool.stop()
+    stop_repositories()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Up to `max_concurrent_updates` updates at once, but never two from the
+    same user, so conversation state changes stay ordered per admin.
+
+    process_update is overridden so the user's lock is taken before a shared
+    slot: one admin's queued updates wait without holding slots that other
+    admins need (the base class takes its semaphore first).
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+        self.locks = {}   # user id -> [lock, updates holding or waiting]
+
+    async def process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            async with self.slots:
+                await self.do_process_update(update, coroutine)
+            return
+        entry = self.locks.get(user.id)
+        if entry is None:
+            entry = self.locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self.slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[user.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def api_request() -> HTTPXRequest:
+    return HTTPXRequest(connection_pool_size=API_POOL_SIZE, pool_timeout=POOL_TIMEOUT)
+
+def build_application():
+    builder = Application.builder().token(TOKEN)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    application = (
+        builder
+        .connection_pool_size(API_POOL_SIZE).pool_timeout(POOL_TIMEOUT)
+        .get_updates_connection_pool_size(UPDATES_POOL_SIZE).get_updates_pool_timeout(POOL_TIMEOUT)
+        .persistence(SessionPersistence(SESSION_FILE, SESSION_FLUSH_INTERVAL))
+        .post_init(on_startup).post_shutdown(on_shutdown)
+        .build()
+    )
+    register_handlers(application)
+    return application
+
 def main():
     ensure_files()
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate-sqlite":
+        try:
+            counts = migrate_json_to_sqlite(force="--force" in sys.argv[2:])
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            return
+        print(f"✅ Migrated to {SQLITE_FILE}: {counts}")
+        return
+    if WEBHOOK_URL:
+        print("ERROR: WEBHOOK_URL is set, updates go to the web service (gunicorn 'bot:create_app()'). Exiting.")
+        return
+    start_repositories()
+    if METRICS_PORT:
+        threading.Thread(
+            target=lambda: create_web_app().run(host="0.0.0.0", port=METRICS_PORT, use_reloader=False),
+            name="metrics", daemon=True
+        ).start()
     if not TOKEN:
         print("ERROR: BOT_TOKEN environment variable not set. Exiting.")
         return
 
     try:  
-        application = Application.builder().token(TOKEN).build()  
-        register_handlers(application)  
+        application = build_application()  
         print("✅ Bot started successfully!")  
         application.run_polling()  
     except Exception as e:  
         print(f"❌ Bot startup failed: {e}")  
         raise
 
+# -----------------------
+# Webhook mode (gunicorn 'bot:create_app()')
+# -----------------------
+class UpdateDeduper:
+    """Remembers the last `size` update ids so redelivered updates are dropped."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+
+    def first_time(self, update_id) -> bool:
+        with self.lock:
+            if update_id in self.seen:
+                return False
+            self.seen[update_id] = True
+            if len(self.seen) > self.size:
+                self.seen.popitem(last=False)
+            return True
+
+class WebhookRuntime:
+    """Runs the same Application as polling mode on a background event loop.
+
+    The web worker thread only validates and enqueues updates; handlers run on
+    this loop, so the HTTP response goes back to Telegram immediately.
+    State is per process — run gunicorn with a single worker.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.application = None
+        self.ready = threading.Event()
+        self.deduper = UpdateDeduper(WEBHOOK_DEDUP_SIZE)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="webhook-runtime", daemon=True)
+        self.thread.start()
+        self.ready.wait(60)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._startup())
+        except Exception:
+            logging.exception("Webhook runtime failed to start")
+            self.ready.set()
+            return
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _startup(self):
+        ensure_files()
+        start_repositories()
+        self.application = build_application()
+        await self.application.initialize()
+        await self.application.start()
+        # post_init শুধু run_polling/run_webhook চালায়, তাই এখানে নিজে ডাকতে হবে
+        await on_startup(self.application)
+        await self.application.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        print(f"✅ Webhook set: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    def submit(self, payload: dict) -> str:
+        """"queued", "duplicate" (already seen or no update_id) or
+        "unavailable" (runtime not running; the update was not taken)."""
+        if self.application is None or not self.application.running:
+            return "unavailable"
+        update_id = payload.get('update_id')
+        if update_id is None or not self.deduper.first_time(update_id):
+            return "duplicate"
+        update = Update.de_json(payload, self.application.bot)
+        asyncio.run_coroutine_threadsafe(self.application.update_queue.put(update), self.loop)
+        return "queued"
+
+    def stop(self):
+        if self.application is None or not self.loop.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        try:
+            future.result(timeout=30)
+        except Exception:
+            logging.exception("Webhook runtime shutdown failed")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _shutdown(self):
+        await self.application.stop()
+        await on_shutdown(self.application)
+        await self.application.shutdown()
+
+webhook_runtime = WebhookRuntime()
+
+def create_web_app():
+    web = Flask(__name__)
+
+    @web.get("/")
+    def health():
+        return "OK", 200
+
+    @web.get("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    @web.post(WEBHOOK_PATH)
+    def telegram_webhook():
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, WEBHOOK_SECRET):
+            abort(403)
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            abort(400)
+        if webhook_runtime.submit(payload) == "unavailable":
+            # ২০০ দিলে Telegram আপডেটটা আর পাঠাবে না, ৫০৩ এ পরে আবার চেষ্টা করবে
+            return "", 503
+        return "", 200
+
+    return web
+
+def create_app():
+    """gunicorn entry point (`gunicorn 'bot:create_app()'`).
+
+    Starts the webhook runtime here rather than at import time, so importing
+    bot (bench.py, migrations, a shell) never logs in or calls set_webhook.
+    """
+    if WEBHOOK_URL:
+        webhook_runtime.start()
+        atexit.register(webhook_runtime.stop)
+    return create_web_app()
+
 if __name__ == "__main__":
     main()